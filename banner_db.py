@@ -0,0 +1,313 @@
+import asyncio
+import contextlib
+import json
+import sqlite3
+import sys
+import threading
+
+from banner_store import BannerStore, banner_io_seconds
+
+# Banner writes run on the event loop, so waiting for another connection's lock (the shul queue, a web
+# worker) has to stay short. A write that times out raises and the transaction puts memory back
+BUSY_TIMEOUT = 0.25
+
+
+def connect(database_file, timeout=BUSY_TIMEOUT):
+    db = sqlite3.connect(database_file, timeout=timeout, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS banners (
+            version TEXT NOT NULL,
+            id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            type TEXT,
+            enabled INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (version, id)
+        )""")
+    db.execute("CREATE INDEX IF NOT EXISTS banners_id ON banners (id)")
+    db.execute("CREATE INDEX IF NOT EXISTS banners_position ON banners (version, position)")
+    db.execute("CREATE INDEX IF NOT EXISTS banners_type ON banners (version, type)")
+    db.execute("CREATE INDEX IF NOT EXISTS banners_enabled ON banners (version, enabled)")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS banner_versions (
+            version TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL,
+            data TEXT NOT NULL
+        )""")
+    return db
+
+
+def banner_row(version, position, banner):
+    return (version, banner["id"], position, banner.get("type"), int(banner.get("enabled", True)),
+            json.dumps(banner, ensure_ascii=False))
+
+
+class SqliteBannerStore(BannerStore):
+    # Same interface as BannerStore, but a change writes one row instead of the whole file
+    def __init__(self, database_file, version, log_size=1000):
+        self.version = version
+        self.db = connect(database_file)
+        self.lock = threading.RLock()
+        super().__init__(database_file, log_size=log_size)
+
+    def _stat(self):
+        # Bumped whenever another connection commits, our own writes leave it alone
+        with self.lock:
+            return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _revision(self):
+        with self.lock:
+            row = self.db.execute("SELECT revision FROM banner_versions WHERE version = ?",
+                                  (self.version,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def _read(self):
+        with self.lock:
+            mtime = self._stat()
+            row = self.db.execute("SELECT revision, data FROM banner_versions WHERE version = ?",
+                                  (self.version,)).fetchone()
+            banners = [json.loads(payload) for payload, in self.db.execute(
+                "SELECT payload FROM banners WHERE version = ? ORDER BY position", (self.version,))]
+
+        data = {} if row is None else json.loads(row[1])
+        data["banners"] = banners
+        if row is not None:
+            data["revision"] = row[0]
+        return data, mtime
+
+    def load(self):
+        super().load()
+        if not self.follower and self._revision() != self.revision:
+            # A reload moves past every revision clients have seen, keep the database in step
+            with self.transaction():
+                self._save_revision()
+
+    def refresh(self):
+        # Other connections include the shul queue, only reload when the banners themselves moved
+        mtime = self._stat()
+        if mtime != self.mtime:
+            self.mtime = mtime
+            if self._revision() != self.revision:
+                self.load()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.db.in_transaction:
+                yield
+                return
+
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError:
+                # Timed out waiting for the lock. put and delete have already changed memory but nothing was
+                # logged yet, so read the banners back without a reload. mtime stays, refresh still sees others
+                data, _ = self._read()
+                data["revision"] = self.revision
+                self.data = data
+                self.banners = {banner["id"]: banner for banner in data["banners"]}
+                raise
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                # Memory already has the changes that just got rolled back
+                self.load()
+                raise
+            self.db.execute("COMMIT")
+
+    def _save_revision(self):
+        data = {key: value for key, value in self.data.items() if key not in ("banners", "revision")}
+        self.db.execute("INSERT INTO banner_versions (version, revision, data) VALUES (?, ?, ?) "
+                        "ON CONFLICT (version) DO UPDATE SET revision = excluded.revision",
+                        (self.version, self.revision, json.dumps(data, ensure_ascii=False)))
+
+    def save(self, change):
+        with banner_io_seconds.time(op="write"), self.transaction():
+            if change["op"] == "delete":
+                self.db.execute("DELETE FROM banners WHERE version = ? AND id = ?", (self.version, change["id"]))
+            else:
+                banner = change["banner"]
+                if change.get("old_id") is not None:
+                    # Renamed, keep the banner in the same position
+                    self.db.execute("UPDATE banners SET id = ? WHERE version = ? AND id = ?",
+                                    (banner["id"], self.version, change["old_id"]))
+
+                position = self.db.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM banners WHERE version = ?",
+                                           (self.version,)).fetchone()[0]
+                self.db.execute("INSERT INTO banners (version, id, position, type, enabled, payload) "
+                                "VALUES (?, ?, ?, ?, ?, ?) "
+                                "ON CONFLICT (version, id) DO UPDATE SET type = excluded.type, "
+                                "enabled = excluded.enabled, payload = excluded.payload",
+                                banner_row(self.version, position, banner))
+
+            self._log(change)
+            self._save_revision()
+
+        self._notify(change)
+
+    def close(self):
+        # Every change is already committed
+        with self.lock:
+            self.db.close()
+
+
+class ChangeLog:
+    # MODE=bot copies each store's change log here, so the MODE=web workers can answer /changes with deltas.
+    # For a version the table holds every change with floor < revision <= head
+    def __init__(self, database_file):
+        self.db = sqlite3.connect(database_file, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.stores = {}
+        self.synced = {}
+        self.pending = []
+        self.write_task = None
+
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS banner_changes (
+                    version TEXT NOT NULL,
+                    revision INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (version, revision)
+                )""")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS banner_change_heads (
+                    version TEXT PRIMARY KEY,
+                    floor INTEGER NOT NULL,
+                    head INTEGER NOT NULL
+                )""")
+
+    def record(self, stores, sources):
+        # Writer side. Sources notify after the projections built on them, so every store is up to date by then
+        self.stores = stores
+        with self.lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            for version, store in stores.items():
+                # Whatever an earlier run left behind doesn't have to match what we loaded
+                self.db.execute("DELETE FROM banner_changes WHERE version = ?", (version,))
+                self.db.execute("DELETE FROM banner_change_heads WHERE version = ?", (version,))
+                self._write_changes(version, store.changes_floor, store.revision, list(store.changes))
+                self.synced[version] = store.revision
+        for source in sources.values():
+            source.subscribe(lambda change: self.sync())
+
+    def sync(self):
+        for version, store in self.stores.items():
+            synced = self.synced[version]
+            if store.revision == synced:
+                continue
+
+            changes = []
+            for change in reversed(store.changes):
+                if change["revision"] <= synced:
+                    break
+                changes.append(change)
+            changes.reverse()
+            self.pending.append((version, store.changes_floor, store.revision, changes))
+            self.synced[version] = store.revision
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._take())
+        else:
+            if self.write_task is None and self.pending:
+                self.write_task = asyncio.create_task(self._write_later())
+
+    def _take(self):
+        pending, self.pending = self.pending, []
+        return pending
+
+    async def _write_later(self):
+        # One write at a time, so the head never moves past changes that aren't in the table yet
+        try:
+            while self.pending:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self._write, self._take())
+                except Exception as e:
+                    print(f'Failed to write the banner change log: {e!r}')
+        finally:
+            self.write_task = None
+
+    def _write(self, updates):
+        with self.lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            for update in updates:
+                self._write_changes(*update)
+
+    def _write_changes(self, version, floor, head, changes):
+        self.db.executemany("INSERT OR REPLACE INTO banner_changes (version, revision, payload) VALUES (?, ?, ?)",
+                            [(version, change["revision"], json.dumps(change, ensure_ascii=False))
+                             for change in changes])
+        self.db.execute("INSERT INTO banner_change_heads (version, floor, head) VALUES (?, ?, ?) "
+                        "ON CONFLICT (version) DO UPDATE SET floor = excluded.floor, head = excluded.head",
+                        (version, floor, head))
+        self.db.execute("DELETE FROM banner_changes WHERE version = ? AND revision <= ?", (version, floor))
+
+    def _changes_since(self, version, since, revision):
+        with self.lock:
+            row = self.db.execute("SELECT floor, head FROM banner_change_heads WHERE version = ?",
+                                  (version,)).fetchone()
+            if row is None or since is None or not row[0] <= since <= revision <= row[1]:
+                # Not logged that far back, or the log hasn't caught up with what this worker serves
+                return None
+            return [json.loads(payload) for payload, in self.db.execute(
+                "SELECT payload FROM banner_changes WHERE version = ? AND revision > ? AND revision <= ? "
+                "ORDER BY revision", (version, since, revision))]
+
+    async def changes_since(self, version, since, revision):
+        # Reader side, `revision` is the one the worker's own snapshot is at
+        return await asyncio.get_running_loop().run_in_executor(None, self._changes_since, version, since,
+                                                                revision)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def migrate(database_file, version, file_name):
+    # One shot, replaces whatever the database has for this version with the JSON file
+    data, _ = BannerStore(file_name)._read()
+    revision = data.get("revision", 0)
+    rest = {key: value for key, value in data.items() if key not in ("banners", "revision")}
+
+    # Nothing else to keep responsive here, so wait as long as sqlite would by default
+    db = connect(database_file, timeout=5.0)
+    try:
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM banners WHERE version = ?", (version,))
+            db.executemany("INSERT INTO banners (version, id, position, type, enabled, payload) "
+                           "VALUES (?, ?, ?, ?, ?, ?)",
+                           [banner_row(version, position, banner) for position, banner in enumerate(data["banners"])])
+            db.execute("INSERT OR REPLACE INTO banner_versions (version, revision, data) VALUES (?, ?, ?)",
+                       (version, revision, json.dumps(rest, ensure_ascii=False)))
+    finally:
+        db.close()
+
+    return len(data["banners"])
+
+
+def export(database_file, version, file_name):
+    store = SqliteBannerStore(database_file, version)
+    try:
+        store.export(file_name)
+        return len(store.banners)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5 or sys.argv[1] not in ("migrate", "export"):
+        print(f'Usage: {sys.argv[0]} migrate|export DATABASE_FILE V1|V2 JSON_FILE')
+        sys.exit(2)
+
+    command, database_file, version, file_name = sys.argv[1:]
+    if command == "migrate":
+        print(f'Copied {migrate(database_file, version, file_name)} {version} banners into {database_file}')
+    else:
+        print(f'Wrote {export(database_file, version, file_name)} {version} banners to {file_name}')
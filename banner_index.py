@@ -0,0 +1,48 @@
+from bisect import bisect_left
+
+
+class BannerIndex:
+    # Sorted (lowercase id, id) pairs, a prefix lookup is a bisect plus at most `limit` steps
+    def __init__(self, store):
+        self.store = store
+        self.keys = []
+        self.rebuild()
+        store.subscribe(self.on_change)
+
+    def rebuild(self):
+        self.keys = sorted((id.lower(), id) for id in self.store.banners)
+
+    def _add(self, id):
+        key = (id.lower(), id)
+        position = bisect_left(self.keys, key)
+        if position == len(self.keys) or self.keys[position] != key:
+            self.keys.insert(position, key)
+
+    def _remove(self, id):
+        key = (id.lower(), id)
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+
+    def on_change(self, change):
+        if change["op"] == "reload":
+            self.rebuild()
+        elif change["op"] == "delete":
+            self._remove(change["id"])
+        else:
+            if change.get("old_id") is not None:
+                self._remove(change["old_id"])
+            self._add(change["id"])
+
+    def search(self, prefix, limit=25):
+        # Picks up hand edits to the file the same way every other store read does
+        self.store.refresh()
+
+        prefix = prefix.lower()
+        ids = []
+        for position in range(bisect_left(self.keys, (prefix,)), len(self.keys)):
+            lowered, id = self.keys[position]
+            if not lowered.startswith(prefix) or len(ids) == limit:
+                break
+            ids.append(id)
+        return ids
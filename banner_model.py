@@ -0,0 +1,247 @@
+import sys
+
+from banner_store import BannerStore
+
+red_types = ["red", "alert", "warning"]
+green_types = ["green", "update"]
+blue_types = ["blue", "general", "holiday"]
+
+red = "#E53E3E"
+green = "#48BB78"
+blue = "#5384D6"
+
+V1_STYLE = {
+    "fontWeight": "bold",
+    "textAlign": "center",
+    "fontSize": 16
+}
+SCHEDULE_FIELDS = ("enabled", "paused", "starts_at", "ends_at")
+
+
+def type_color(type):
+    if type in red_types:
+        return red
+    elif type in green_types:
+        return green
+    return blue
+
+
+def color_type(color, type=None):
+    # Keep the more specific type (alert, update, ...) as long as it still maps to this color
+    if type is not None and type_color(type) == color:
+        return type
+    return {red: "red", green: "green", blue: "blue"}.get(color)
+
+
+# A canonical banner is the V2 shape plus "versions", the apps it shows in. V1 only details are optional
+# overrides: "title" when it differs from the content, "style" when it differs from the V1 defaults
+def project_v2(banner):
+    projected = {
+        "id": banner["id"],
+        "type": banner["type"],
+        "persistent": banner.get("persistent", True),
+        "header": banner.get("header", ""),
+        "content": banner["content"]
+    }
+    for field in SCHEDULE_FIELDS:
+        if field in banner:
+            projected[field] = banner[field]
+    return projected
+
+
+def project_v1(banner):
+    style = dict(V1_STYLE, color=type_color(banner["type"]))
+    style.update(banner.get("style", {}))
+
+    projected = {
+        "id": banner["id"],
+        "title": banner.get("title", banner["content"]),
+        "style": style
+    }
+    for field in SCHEDULE_FIELDS:
+        if field in banner:
+            projected[field] = banner[field]
+    return projected
+
+
+def merge_v2(banner, old=None):
+    merged = dict(old or {}, id=banner["id"], type=banner["type"], persistent=banner.get("persistent", True),
+                  header=banner.get("header", ""), content=banner["content"])
+    if old is not None and merged.get("title") == merged["content"]:
+        del merged["title"]
+    return _merge_common(merged, banner, "V2")
+
+
+def merge_v1(banner, old=None):
+    merged = dict(old or {}, id=banner["id"])
+
+    style = dict(banner["style"])
+    color = style.pop("color")
+    type = color_type(color, merged.get("type"))
+    if type is None:
+        # Not one of our colors, only V1 can show it
+        style["color"] = color
+        type = merged.get("type", "general")
+    merged["type"] = type
+
+    style = {key: value for key, value in style.items() if V1_STYLE.get(key) != value}
+    if style:
+        merged["style"] = style
+    else:
+        merged.pop("style", None)
+
+    if "content" not in merged or "V2" not in merged.get("versions", ()) or merged["content"] == banner["title"]:
+        merged["content"] = banner["title"]
+        merged.pop("title", None)
+    else:
+        merged["title"] = banner["title"]
+    return _merge_common(merged, banner, "V1")
+
+
+def _merge_common(merged, banner, version):
+    for field in SCHEDULE_FIELDS:
+        if field in banner:
+            merged[field] = banner[field]
+        else:
+            merged.pop(field, None)
+
+    merged["versions"] = sorted(set(merged.get("versions", ())) | {version}, reverse=True)
+    return merged
+
+
+PROJECTIONS = {
+    "V2": (project_v2, merge_v2),
+    "V1": (project_v1, merge_v1)
+}
+
+
+class BannerProjection(BannerStore):
+    # A V1 or V2 view of the canonical store. Reads come from a per banner cache that is only recomputed
+    # for banners that changed, writes go back to the canonical banner
+    def __init__(self, source, version, log_size=1000):
+        self.source = source
+        self.version = version
+        self.project, self.merge = PROJECTIONS[version]
+        self.cache = {}
+        super().__init__(None, log_size=log_size)
+        source.subscribe(self.on_change)
+
+    def _stat(self):
+        return None
+
+    def _project(self, banner):
+        cached = self.cache.get(banner["id"])
+        # Canonical banners are replaced rather than mutated, so the same object means the same projection
+        if cached is not None and cached[0] is banner:
+            return cached[1]
+
+        projected = self.project(banner)
+        self.cache[banner["id"]] = (banner, projected)
+        return projected
+
+    def _read(self):
+        self.cache = {}
+        banners = [self._project(banner) for banner in self.source.banners.values()
+                   if self.version in banner.get("versions", ())]
+        return {"banners": banners, "revision": self.source.revision}, None
+
+    def refresh(self):
+        # A reload of the source comes back through on_change
+        self.source.refresh()
+
+    def on_change(self, change):
+        if change["op"] == "reload":
+            self.load()
+            return
+
+        id = change["id"]
+        old_id = change.get("old_id")
+        known = old_id if old_id is not None and old_id in self.banners else id
+        banner = change.get("banner")
+        if banner is None or self.version not in banner.get("versions", ()):
+            self.cache.pop(id, None)
+            if known not in self.banners:
+                self._skip(change)
+                return
+            del self.banners[known]
+            projected_change = {"op": "delete", "id": known}
+        else:
+            projected = self._project(banner)
+            if known in self.banners and known != id:
+                self.cache.pop(known, None)
+                self.banners = {(id if key == known else key): (projected if key == known else value)
+                                for key, value in self.banners.items()}
+                projected_change = {"op": "edit", "id": id, "old_id": known, "banner": projected}
+            else:
+                if self.banners.get(id) == projected:
+                    # Nothing this version shows changed
+                    self.banners[id] = projected
+                    self._skip(change)
+                    return
+                op = "edit" if id in self.banners else "add"
+                self.banners[id] = projected
+                projected_change = {"op": op, "id": id, "banner": projected}
+
+        self._log(projected_change, change["revision"])
+        self._notify(projected_change)
+
+    def _skip(self, change):
+        # Keep counting with the source, so a process that only reloads the source lands on the same revision
+        self.revision = change["revision"]
+        self.data["revision"] = self.revision
+
+    def transaction(self):
+        return self.source.transaction()
+
+    def collides(self, id, old_id):
+        # V1 and V2 share ids, so a rename can't land on a banner that only the other version shows either
+        return self.source.collides(id, old_id)
+
+    def put(self, banner, old_id=None):
+        self.refresh()
+        old = self.source.get(old_id if old_id is not None else banner["id"])
+        self.source.put(self.merge(banner, old), old_id)
+
+    def delete(self, id):
+        self.refresh()
+        banner = self.source.get(id)
+        if banner is None or self.version not in banner.get("versions", ()):
+            return
+
+        versions = [version for version in banner["versions"] if version != self.version]
+        if versions:
+            self.source.put(dict(banner, versions=versions))
+        else:
+            self.source.delete(id)
+
+    def flush(self):
+        pass
+
+    async def aflush(self):
+        pass
+
+
+def migrate(target, v2_file, v1_file):
+    # One shot, folds the V2 and V1 files into the canonical store. The same id in both becomes one banner
+    with target.transaction():
+        for version, file_name in (("V2", v2_file), ("V1", v1_file)):
+            merge = PROJECTIONS[version][1]
+            for banner in BannerStore(file_name).all():
+                target.put(merge(banner, target.get(banner["id"])))
+    return len(target.banners)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5) or (len(sys.argv) == 5 and sys.argv[3] != "--sqlite"):
+        print(f'Usage: {sys.argv[0]} V2_FILE V1_FILE (BANNERS_FILE | --sqlite DATABASE_FILE)')
+        sys.exit(2)
+
+    if len(sys.argv) == 5:
+        from banner_db import SqliteBannerStore
+
+        store = SqliteBannerStore(sys.argv[4], "canonical")
+    else:
+        store = BannerStore(sys.argv[3])
+
+    print(f'{migrate(store, sys.argv[1], sys.argv[2])} canonical banners')
+    store.close()
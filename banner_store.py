@@ -0,0 +1,405 @@
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from collections import deque
+
+from metrics import Histogram
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+banner_io_seconds = Histogram("shulert_banner_io_seconds", "Time spent reading, writing and publishing banners",
+                              ("op",))
+
+
+def write_atomic(file_name, body):
+    # Readers (and the CDN) see the old file or the new one, never half of one
+    directory = os.path.dirname(os.path.abspath(file_name))
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".%s." % os.path.basename(file_name), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(body)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class BannerStore:
+    # Set in MODE=web, where another process does the writing and its revisions are taken as they are
+    follower = False
+
+    def __init__(self, file_name, flush_delay=0.5, log_size=1000):
+        self.file_name = file_name
+        self.flush_delay = flush_delay
+        self.data = {"banners": []}
+        self.banners = {}
+        self.mtime = None
+        self.revision = None
+        self.changes = deque(maxlen=log_size)
+        self.changes_floor = 0
+        self.listeners = []
+        self.dirty = False
+        self.flush_task = None
+        self.flush_lock = None
+        self.saved_banners = None
+        self.load()
+
+    def _stat(self):
+        try:
+            return os.stat(self.file_name).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        mtime = self._stat()
+        if mtime is not None:
+            with open(self.file_name, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        else:
+            data = {
+                "banners": []
+            }
+        return data, mtime
+
+    def load(self):
+        with banner_io_seconds.time(op="read"):
+            data, mtime = self._read()
+
+        self.data = data
+        self.banners = {banner["id"]: banner for banner in data["banners"]}
+        self.mtime = mtime
+
+        revision = data.get("revision", 0)
+        reloaded = self.revision is not None
+        if reloaded and not self.follower:
+            # Reloaded from an outside change, we can't tell what changed so clients need a full snapshot
+            revision = max(revision, self.revision + 1)
+        self.revision = revision
+        self.data["revision"] = revision
+        self.changes.clear()
+        self.changes_floor = revision
+
+        if reloaded:
+            self._notify({"op": "reload", "revision": revision})
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, change):
+        for listener in self.listeners:
+            listener(change)
+
+    def refresh(self):
+        # Someone edited the file by hand (or another process wrote it), pick the changes up.
+        # While we have unflushed changes the file on disk is older than memory, so leave it alone
+        if not self.dirty and self.flush_task is None and self._stat() != self.mtime:
+            self.load()
+
+    def all(self):
+        self.refresh()
+        return list(self.banners.values())
+
+    def ids(self):
+        self.refresh()
+        return self.banners.keys()
+
+    def get(self, id):
+        self.refresh()
+        return self.banners.get(id)
+
+    def collides(self, id, old_id):
+        # Renaming old_id to id would replace a different banner
+        self.refresh()
+        return old_id is not None and id != old_id and id in self.banners
+
+    def put(self, banner, old_id=None):
+        if self.collides(banner["id"], old_id):
+            raise ValueError("There's already a banner with the ID %s" % banner["id"])
+        if old_id is not None and old_id != banner["id"] and old_id in self.banners:
+            # Renamed, keep the banner in the same position
+            self.banners = {(banner["id"] if key == old_id else key): (banner if key == old_id else value)
+                            for key, value in self.banners.items()}
+            self.save({"op": "edit", "id": banner["id"], "old_id": old_id, "banner": banner})
+        else:
+            op = "edit" if banner["id"] in self.banners else "add"
+            self.banners[banner["id"]] = banner
+            self.save({"op": op, "id": banner["id"], "banner": banner})
+
+    def delete(self, id):
+        self.refresh()
+        if self.banners.pop(id, None) is not None:
+            self.save({"op": "delete", "id": id})
+
+    def changes_since(self, since):
+        self.refresh()
+        if since is None or since < self.changes_floor or since > self.revision:
+            # Aged out of the log (or from before a reload), caller has to fall back to a snapshot
+            return None
+
+        changes = []
+        for change in reversed(self.changes):
+            if change["revision"] <= since:
+                break
+            changes.append(change)
+        changes.reverse()
+        return changes
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # Changes made in here go out in one write, the debounced flush on the event loop and a single flush
+        # when the outermost block ends off it. If one fails, memory goes back to how it was and listeners see
+        # that as a reload
+        if self.saved_banners is not None:
+            yield
+            return
+
+        self.refresh()
+        self.saved_banners = dict(self.banners)
+        revision = self.revision
+        try:
+            yield
+        except BaseException:
+            if self.revision != revision:
+                self._rollback(self.saved_banners)
+            raise
+        finally:
+            self.saved_banners = None
+            if self.dirty:
+                self._write_soon()
+
+    def _rollback(self, banners):
+        self.banners = banners
+        self.revision += 1
+        self.data["revision"] = self.revision
+        self.changes.clear()
+        self.changes_floor = self.revision
+        self._write_soon()
+        self._notify({"op": "reload", "revision": self.revision})
+
+    def save(self, change):
+        self._log(change)
+        self._write_soon()
+        self._notify(change)
+
+    def _write_soon(self):
+        self.dirty = True
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on the event loop (scripts, scheduler threads), nothing to block so write now. Inside a
+            # transaction that waits for the end of it
+            if self.saved_banners is None:
+                self.flush()
+        else:
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self._flush_later())
+
+    def _log(self, change, revision=None):
+        self.revision = self.revision + 1 if revision is None else revision
+        self.data["revision"] = self.revision
+
+        if len(self.changes) == self.changes.maxlen:
+            self.changes_floor = self.changes[0]["revision"]
+        change["revision"] = self.revision
+        self.changes.append(change)
+
+    def snapshot(self):
+        # Banners are replaced rather than mutated, so a shallow copy is safe to serialize on another thread
+        return dict(self.data, banners=list(self.banners.values()))
+
+    def _write(self, data, file_name=None):
+        if file_name is None:
+            file_name = self.file_name
+
+        with banner_io_seconds.time(op="write"):
+            write_atomic(file_name, json.dumps(data, indent=4).encode("utf-8"))
+        return self._stat()
+
+    def export(self, file_name):
+        self._write(self.snapshot(), file_name)
+
+    async def _flush_later(self):
+        try:
+            while self.dirty:
+                # Let edits that land close together pile up into a single write
+                await asyncio.sleep(self.flush_delay)
+                try:
+                    await self.aflush()
+                except Exception as e:
+                    print(f'Failed to write {self.file_name}: {e!r}')
+        finally:
+            self.flush_task = None
+
+    async def aflush(self):
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+
+        async with self.flush_lock:
+            if not self.dirty:
+                return
+
+            data = self.snapshot()
+            self.dirty = False
+            try:
+                self.mtime = await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+            except BaseException:
+                self.dirty = True
+                raise
+
+    def flush(self):
+        if self.dirty:
+            data = self.snapshot()
+            self.dirty = False
+            try:
+                self.mtime = self._write(data)
+            except BaseException:
+                self.dirty = True
+                raise
+
+    def close(self):
+        self.flush()
+
+
+class BannerFeed:
+    def __init__(self, store):
+        self.store = store
+        self.revision = None
+        self.body = None
+        self.gzip_body = None
+        self.brotli_body = None
+        self.sha256 = None
+        self.etag = None
+
+    def get(self):
+        # Serialize and compress once per change, every request in between is served straight from memory
+        self.store.refresh()
+        if self.revision != self.store.revision:
+            body = json.dumps(self.store.snapshot(), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+            self.body = body
+            self.gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+            # Brotli's default quality 11 takes seconds on a few MB and this runs on the event loop.
+            # 4 is two orders of magnitude faster and still smaller than gzip -9
+            self.brotli_body = None if brotli is None else brotli.compress(body, mode=brotli.MODE_TEXT, quality=4)
+            self.sha256 = hashlib.sha256(body).hexdigest()
+            self.etag = self.sha256[:32]
+            self.revision = self.store.revision
+
+        return self
+
+
+class BannerPublisher:
+    # Writes the feed next to the banner file as name.min.json(.gz/.br) plus name.manifest.json for the CDN.
+    # When the store isn't that file (BANNER_BACKEND=sqlite or BANNER_MODEL=canonical) it writes the file too
+    def __init__(self, feed, file_name, delay=0.5):
+        self.feed = feed
+        self.delay = delay
+        base_name = file_name[:-len(".json")] if file_name.endswith(".json") else file_name
+        self.full_file = None if feed.store.file_name == file_name else file_name
+        self.body_file = base_name + ".min.json"
+        self.manifest_file = base_name + ".manifest.json"
+        self.published = None
+        self.pending = False
+        self.publish_task = None
+        self.publish_lock = None
+
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as fp:
+                self.published = json.load(fp).get("content_sha256")
+        except (FileNotFoundError, ValueError):
+            pass
+        if self.full_file is not None and not os.path.exists(self.full_file):
+            self.published = None
+
+        feed.store.subscribe(self.on_change)
+
+    def on_change(self, change):
+        self.pending = True
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.publish()
+        else:
+            if self.publish_task is None:
+                self.publish_task = asyncio.create_task(self._publish_later())
+
+    def _variants(self):
+        feed = self.feed.get()
+        # The body carries the revision, which moves on every write even when no banner changed
+        content = json.dumps(self.feed.store.snapshot()["banners"], separators=(",", ":"), ensure_ascii=False)
+        content_sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if content_sha256 == self.published:
+            return None
+
+        manifest = {
+            "revision": feed.revision,
+            "sha256": feed.sha256,
+            "content_sha256": content_sha256,
+            "files": {
+                "json": {"name": os.path.basename(self.body_file), "size": len(feed.body)},
+                "gzip": {"name": os.path.basename(self.body_file) + ".gz", "size": len(feed.gzip_body)}
+            }
+        }
+        variants = [(self.body_file, feed.body), (self.body_file + ".gz", feed.gzip_body)]
+        if feed.brotli_body is not None:
+            manifest["files"]["br"] = {"name": os.path.basename(self.body_file) + ".br",
+                                       "size": len(feed.brotli_body)}
+            variants.append((self.body_file + ".br", feed.brotli_body))
+        if self.full_file is not None:
+            variants.append((self.full_file, json.dumps(self.feed.store.snapshot(), indent=4).encode("utf-8")))
+
+        # The manifest goes last, so anything that reads it finds the files it points at
+        variants.append((self.manifest_file, json.dumps(manifest, indent=4).encode("utf-8")))
+        return content_sha256, variants
+
+    @staticmethod
+    def _write(variants):
+        with banner_io_seconds.time(op="publish"):
+            for file_name, body in variants:
+                write_atomic(file_name, body)
+
+    async def _publish_later(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(self.delay)
+                try:
+                    await self.apublish()
+                except Exception as e:
+                    print(f'Failed to publish {self.body_file}: {e!r}')
+        finally:
+            self.publish_task = None
+
+    async def apublish(self):
+        if self.publish_lock is None:
+            self.publish_lock = asyncio.Lock()
+
+        async with self.publish_lock:
+            self.pending = False
+            variants = self._variants()
+            if variants is not None:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self._write, variants[1])
+                except BaseException:
+                    self.pending = True
+                    raise
+                self.published = variants[0]
+
+    def publish(self):
+        self.pending = False
+        variants = self._variants()
+        if variants is not None:
+            self._write(variants[1])
+            self.published = variants[0]
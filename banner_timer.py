@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timezone
+
+# Re-arm at least this often so a wall clock jump can't leave a banner waiting
+MAX_SLEEP = 3600
+# Seconds before a flip that failed (say the database was locked) is tried again
+RETRY_DELAY = 5
+
+
+def parse_time(value):
+    moment = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def format_time(moment):
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def is_live(banner, now=None):
+    if now is None:
+        now = time.time()
+
+    starts_at = banner.get("starts_at")
+    ends_at = banner.get("ends_at")
+    if starts_at is not None and parse_time(starts_at).timestamp() > now:
+        return False
+    if ends_at is not None and parse_time(ends_at).timestamp() <= now:
+        return False
+    return True
+
+
+def apply_schedule(banner, now=None):
+    # A scheduled banner is on while it's live, unless an admin switched it off (paused), which the schedule
+    # never overrides. Enabling it again or clearing the schedule lifts the pause
+    if banner.get("starts_at") is None and banner.get("ends_at") is None:
+        banner.pop("paused", None)
+        return banner
+
+    if is_live(banner, now) and not banner.get("paused"):
+        banner.pop("enabled", None)
+    else:
+        banner["enabled"] = False
+    return banner
+
+
+class BannerTimer:
+    def __init__(self, stores):
+        self.stores = stores
+        self.heap = []
+        self.counter = itertools.count()
+        self.handle = None
+        self.armed_at = None
+        self.applying = False
+        self.started = False
+
+        for version, store in stores.items():
+            store.subscribe(lambda change, version=version: self.on_change(version, change))
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+
+        for version in self.stores:
+            self._track_all(version, catch_up=True)
+        self.arm()
+
+    def _track_all(self, version, catch_up=False):
+        now = time.time()
+        for banner in self.stores[version].all():
+            if catch_up:
+                # Anything that came due while we were down
+                self._apply(version, banner, now)
+            self.track(version, banner, now)
+
+    def track(self, version, banner, now=None):
+        if now is None:
+            now = time.time()
+
+        for field in ("starts_at", "ends_at"):
+            value = banner.get(field)
+            if value is None:
+                continue
+
+            when = parse_time(value).timestamp()
+            if when > now:
+                heapq.heappush(self.heap, (when, next(self.counter), version, banner["id"], field, value))
+
+    def on_change(self, version, change):
+        if self.applying or not self.started:
+            return
+
+        if change["op"] == "reload":
+            self._track_all(version)
+        elif change["op"] in ("add", "edit"):
+            self.track(version, change["banner"])
+        else:
+            return
+        self.arm()
+
+    def arm(self):
+        if not self.heap:
+            if self.handle is not None:
+                self.handle.cancel()
+                self.handle = None
+            return
+
+        when = self.heap[0][0]
+        if self.handle is not None:
+            if self.armed_at <= when:
+                return
+            self.handle.cancel()
+
+        loop = asyncio.get_running_loop()
+        delay = min(max(when - time.time(), 0), MAX_SLEEP)
+        self.handle = loop.call_at(loop.time() + delay, self.fire)
+        self.armed_at = when
+
+    def fire(self):
+        self.handle = None
+        now = time.time()
+
+        try:
+            while self.heap and self.heap[0][0] <= now:
+                _, _, version, id, field, value = heapq.heappop(self.heap)
+                banner = self.stores[version].get(id)
+                # Edited or deleted since this was queued, the edit queued its own entry
+                if banner is None or banner.get(field) != value:
+                    continue
+                try:
+                    self._apply(version, banner, now)
+                except Exception as e:
+                    print(f'Failed to apply the schedule of banner {id}: {e!r}')
+                    heapq.heappush(self.heap, (now + RETRY_DELAY, next(self.counter), version, id, field, value))
+        finally:
+            self.arm()
+
+    def _apply(self, version, banner, now):
+        if banner.get("starts_at") is None and banner.get("ends_at") is None:
+            return
+
+        enabled = is_live(banner, now) and not banner.get("paused")
+        if banner.get("enabled", True) == enabled:
+            return
+
+        banner = apply_schedule(dict(banner), now)
+        self.applying = True
+        try:
+            self.stores[version].put(banner)
+        finally:
+            self.applying = False
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def timed(function, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        result = function()
+        if inspect.isawaitable(result):
+            await result
+    return time.perf_counter() - start
+
+
+async def bench(function, min_time=0.2, repeat=5):
+    # Like timeit's autorange, grow the loop until a round is long enough to time reliably
+    number = 1
+    while True:
+        elapsed = await timed(function, number)
+        if elapsed >= min_time / repeat or number >= 10 ** 6:
+            break
+        number *= 10 if elapsed < min_time / repeat / 10 else 2
+
+    per_call = sorted([elapsed / number] + [await timed(function, number) / number for _ in range(repeat - 1)])
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_us": round(per_call[0] * 10 ** 6, 3),
+        "median_us": round(per_call[len(per_call) // 2] * 10 ** 6, 3)
+    }
+
+
+def synthetic_banners(count):
+    return [{
+        "id": f"banner_{index}",
+        "type": ("alert", "update", "general")[index % 3],
+        "persistent": index % 2 == 0,
+        "header": f"Banner header {index}",
+        "content": "Mincha will be at 1:45 today, followed by a shiur in the main beis medrash. " * 2
+    } for index in range(count)]
+
+
+def year_of_items(year):
+    from hebrew_calendar import HebrewCalendar
+
+    days = HebrewCalendar(span=0, start_year=year).days
+    return [item for day in sorted(days) for item in days[day]]
+
+
+class Suite:
+    def __init__(self, main, directory, min_time):
+        self.main = main
+        self.directory = directory
+        self.min_time = min_time
+        self.results = {}
+
+    async def run(self, name, function):
+        result = await bench(function, self.min_time)
+        self.results[name] = result
+        print(f'{name:<44} {result["median_us"]:>14.3f} us  (best {result["best_us"]:.3f}, '
+              f'{result["number"]} x {result["repeat"]})')
+
+    async def escapes(self):
+        plain = "Shabbos candle lighting is at 7:12 pm this week. " * 200
+        escaped = "Shabbos candle lighting\\nis at 7:12 pm\\u2014this week. " * 200
+        await self.run("decode_escapes/plain_10k", lambda: self.main.decode_escapes(plain))
+        await self.run("decode_escapes/escaped_10k", lambda: self.main.decode_escapes(escaped))
+
+    async def embeds(self):
+        main = self.main
+        banner = synthetic_banners(1)[0]
+        await self.run("discord_embed", lambda: main.discord_embed(
+            banner["id"], banner["type"], banner["content"], True, banner["header"], banner["persistent"],
+            starts_at="2024-03-24T18:00:00Z", ends_at="2024-03-25T18:00:00Z"))
+        await self.run("shul_discord_embed", lambda: main.shul_discord_embed(
+            "Congregation Beth Israel", "Ashkenaz", "Orthodox", "123 Main St", "Teaneck", "NJ", "07666", 40.89,
+            -74.01, "Rabbi Test", "office@example.com", "555-555-5555", "https://example.com"))
+
+        from shul_model import parse_shul
+
+        payload = {"name": "Congregation Beth Israel", "rabbi": "Rabbi Test", "nusach": "Ashkenaz",
+                   "affiliation": "Orthodox", "email": "office@example.com", "phone": "(555) 555-5555",
+                   "website": "example.com", "address": "123 Main St", "city": "Teaneck", "state": "NJ",
+                   "zipcode": "07666", "latitude": "40.89", "longitude": -74.01}
+        await self.run("parse_shul", lambda: parse_shul(payload))
+
+    async def holidays(self):
+        main = self.main
+        today = date.today()
+        items = year_of_items(today.year)
+        await self.run(f"holiday_matcher.active/{len(items)}_items",
+                       lambda: main.holiday_matcher.active(items, today))
+
+        from hebrew_calendar import HebrewCalendar
+
+        main.holiday_calendar = HebrewCalendar(span=1)
+        await self.run("holiday_banners", main.holiday_banners)
+
+    async def banners(self, size):
+        main = self.main
+        store = main.banner_stores["V2"]
+        banners_file = os.path.join(self.directory, f"synthetic-{size}.json")
+        with open(banners_file, "w", encoding="utf-8") as fp:
+            json.dump({"banners": synthetic_banners(size)}, fp, indent=4)
+
+        def reset():
+            # Every benchmark starts from the same `size` banners, not whatever the one before left behind
+            if store.flush_task is not None:
+                store.flush_task.cancel()
+                store.flush_task = None
+            store.dirty = False
+            shutil.copyfile(banners_file, store.file_name)
+            store.load()
+
+        new_ids = (f"new_{index}" for index in range(10 ** 9))
+        old_ids = (f"banner_{index % size}" for index in range(10 ** 9))
+
+        def add():
+            main.add_edit_banner_json({"id": next(new_ids), "type": "general", "persistent": True,
+                                       "header": "Added", "content": "Added"}, "V2")
+
+        def edit():
+            main.add_edit_banner_json({"id": None, "type": None, "persistent": None, "header": None,
+                                       "content": "Edited"}, "V2", f"banner_{size // 2}")
+
+        def delete():
+            banner = store.get(next(old_ids))
+            main.delete_banner("V2", banner)
+            # Straight back in without going through put, so every call deletes a real banner
+            store.banners[banner["id"]] = banner
+
+        def flush():
+            store.dirty = True
+            store.flush()
+
+        def feed():
+            main.banner_feeds["V2"].revision = None
+            main.banner_feeds["V2"].get()
+
+        # Edits only touch memory and leave the write to the flush task, so that is measured on its own
+        benchmarks = [("get_banners", store.all), ("add_edit_banner_json/add", add),
+                      ("add_edit_banner_json/edit", edit), ("delete_banner", delete), ("store.flush", flush),
+                      ("feed.get", feed)]
+        for name, function in benchmarks:
+            reset()
+            await self.run(f"{name}/{size}", function)
+        reset()
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    directory = tempfile.mkdtemp(prefix="shulert-benchmarks-")
+    os.environ.update({
+        "GUILD_ID": "1",
+        "CHANNEL_ID": "1",
+        "V2_FILE": os.path.join(directory, "V2.json"),
+        "V1_FILE": os.path.join(directory, "V1.json"),
+        "BANNERS_FILE": os.path.join(directory, "banners.json"),
+        "DATABASE_FILE": os.path.join(directory, "shulert.db"),
+        "SHULS_SNAPSHOT_FILE": os.path.join(directory, "shuls-snapshot.ndjson"),
+        "HOLIDAYS_FILE": os.path.join(ROOT, "holidays.json"),
+        "HOLIDAY_BACKEND": "local",
+        "BANNER_BACKEND": "json",
+        "BANNER_MODEL": "split"
+    })
+
+    import main
+
+    suite = Suite(main, directory, args.min_time)
+    try:
+        await suite.escapes()
+        await suite.embeds()
+        await suite.holidays()
+        for size in args.sizes:
+            await suite.banners(size)
+    finally:
+        main.pending_shuls.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": suite.results
+    }
+
+
+def compare(report, baseline_file):
+    with open(baseline_file, "r", encoding="utf-8") as fp:
+        baseline = json.load(fp)
+
+    print(f'\nAgainst {baseline_file} ({baseline.get("revision")})')
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if before is not None and before["median_us"]:
+            print(f'{name:<44} {result["median_us"] / before["median_us"]:>8.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Time the per interaction hot paths")
+    parser.add_argument("--sizes", default="100,10000,100000", help="banner counts for the store benchmarks")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to spend per benchmark, roughly")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file from an earlier run to compare against")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=4)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
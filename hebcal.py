@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+import aiohttp
+
+from metrics import Counter, Histogram
+
+hebcal_seconds = Histogram("shulert_hebcal_seconds", "Hebcal calendar fetch latency")
+hebcal_errors = Counter("shulert_hebcal_errors_total", "Hebcal calendar fetches that failed")
+
+
+class HebcalClient:
+    def __init__(self, api, cache_file, max_age=timedelta(days=30), timeout=10):
+        self.api = api
+        self.cache_file = cache_file
+        self.max_age = max_age
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.calendars = None
+
+    def _load(self):
+        if os.path.isfile(self.cache_file):
+            with open(self.cache_file, "r", encoding="utf-8") as fp:
+                return json.load(fp)
+        return {}
+
+    def _save(self, calendars):
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".%s." % os.path.basename(self.cache_file),
+                                         suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump(calendars, fp)
+            os.replace(temp_name, self.cache_file)
+        except BaseException:
+            try:
+                os.unlink(temp_name)
+            except FileNotFoundError:
+                pass
+            raise
+
+    @hebcal_seconds.time()
+    async def _fetch(self, year):
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            async with session.get(self.api + f"&year={year}") as resp:
+                resp.raise_for_status()
+                res = await resp.json(content_type=None)
+
+        return res["items"]
+
+    async def calendar(self, year):
+        loop = asyncio.get_running_loop()
+        if self.calendars is None:
+            self.calendars = await loop.run_in_executor(None, self._load)
+
+        cached = self.calendars.get(str(year))
+        if cached is not None and date.today() - date.fromisoformat(cached["fetched"]) < self.max_age:
+            return cached["items"]
+
+        try:
+            items = await self._fetch(year)
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            hebcal_errors.inc()
+            print(f'Failed to fetch the {year} Hebcal calendar: {e!r}')
+            # Hebcal is unreachable, keep going with whatever we had last
+            return cached["items"] if cached is not None else None
+
+        self.calendars[str(year)] = {
+            "fetched": date.today().isoformat(),
+            "items": items
+        }
+        await loop.run_in_executor(None, self._save, dict(self.calendars))
+        return items
+
+    async def items_between(self, start, end):
+        items = []
+        for year in range(start.year, end.year + 1):
+            calendar = await self.calendar(year)
+            if calendar is None:
+                return None
+
+            items.extend(item for item in calendar if start <= date.fromisoformat(item["date"][:10]) <= end)
+
+        return items
@@ -0,0 +1,160 @@
+import json
+import sys
+from datetime import date, timedelta
+
+# Fixed day number (date.toordinal) of 1 Tishrei, year 1
+HEBREW_EPOCH = -1373427
+
+TISHREI = 1
+CHESHVAN = 2
+KISLEV = 3
+TEVES = 4
+SHVAT = 5
+ADAR_I = 6
+ADAR = 7
+NISAN = 8
+IYAR = 9
+SIVAN = 10
+TAMMUZ = 11
+AV = 12
+ELUL = 13
+
+ROMAN = ["I", "II", "III", "IV", "V", "VI", "VII", "VIII"]
+
+
+def is_leap_year(year):
+    return (7 * year + 1) % 19 < 7
+
+
+def _elapsed_days(year):
+    months = (235 * year - 234) // 19
+    parts = 12084 + 13753 * months
+    days = 29 * months + parts // 25920
+    # Lo ADU Rosh
+    if (3 * (days + 1)) % 7 < 3:
+        days += 1
+    return days
+
+
+def _year_length_correction(year):
+    previous = _elapsed_days(year - 1)
+    current = _elapsed_days(year)
+    following = _elapsed_days(year + 1)
+
+    if following - current == 356:
+        return 2
+    if current - previous == 382:
+        return 1
+    return 0
+
+
+def new_year(year):
+    return HEBREW_EPOCH + _elapsed_days(year) + _year_length_correction(year)
+
+
+def days_in_year(year):
+    return new_year(year + 1) - new_year(year)
+
+
+def days_in_month(year, month):
+    if month == CHESHVAN:
+        return 30 if days_in_year(year) % 10 == 5 else 29
+    if month == KISLEV:
+        return 29 if days_in_year(year) % 10 == 3 else 30
+    if month == ADAR_I:
+        return 30 if is_leap_year(year) else 0
+    return 30 if month in (TISHREI, SHVAT, NISAN, SIVAN, AV) else 29
+
+
+def to_gregorian(year, month, day):
+    # Months are counted from Tishrei, Adar I only has days in a leap year
+    fixed = new_year(year) + day - 1
+    for previous in range(TISHREI, month):
+        fixed += days_in_month(year, previous)
+    return date.fromordinal(fixed)
+
+
+def _span(start, titles):
+    return [(start + timedelta(days=offset), title) for offset, title in enumerate(titles)]
+
+
+def holidays(year):
+    # Diaspora schedule for the Hebrew year, titled the way Hebcal's Ashkenazi transliteration titles them
+    rosh_hashana = to_gregorian(year, TISHREI, 1)
+    purim = to_gregorian(year, ADAR, 14)
+    pesach = to_gregorian(year, NISAN, 15)
+    shavuos = to_gregorian(year, SIVAN, 6)
+
+    days = [(rosh_hashana - timedelta(days=1), "Erev Rosh Hashana"),
+            (rosh_hashana, f"Rosh Hashana {year}"),
+            (rosh_hashana + timedelta(days=1), "Rosh Hashana II")]
+    days += _span(to_gregorian(year, TISHREI, 14),
+                  ["Erev Sukkos"] + [f"Sukkos {numeral}" for numeral in ROMAN[:2]] +
+                  [f"Sukkos {numeral} (CH''M)" for numeral in ROMAN[2:6]] + ["Sukkos VII (Hoshana Raba)"])
+    days += _span(to_gregorian(year, KISLEV, 24),
+                  ["Chanukah: 1 Candle"] + [f"Chanukah: {count} Candles" for count in range(2, 9)] +
+                  ["Chanukah: 8th Day"])
+    days.append((to_gregorian(year, SHVAT, 15), "Tu BiShvat"))
+    days += _span(purim - timedelta(days=1), ["Erev Purim", "Purim", "Shushan Purim"])
+    days += _span(pesach - timedelta(days=1),
+                  ["Erev Pesach"] + [f"Pesach {numeral}" for numeral in ROMAN[:2]] +
+                  [f"Pesach {numeral} (CH''M)" for numeral in ROMAN[2:6]] +
+                  [f"Pesach {numeral}" for numeral in ROMAN[6:8]])
+    days.append((to_gregorian(year, IYAR, 18), "Lag BaOmer"))
+    days += _span(shavuos - timedelta(days=1), ["Erev Shavuos", "Shavuos I", "Shavuos II"])
+    return days
+
+
+class HebrewCalendar:
+    def __init__(self, span=10, start_year=None):
+        self.days = {}
+        self.years = set()
+
+        if start_year is None:
+            start_year = date.today().year - 1
+        for year in range(start_year, start_year + span + 1):
+            self._compute(year)
+
+    def _compute(self, year):
+        # A Gregorian year overlaps the end of one Hebrew year and the start of the next
+        for hebrew_year in (year + 3760, year + 3761):
+            for day, title in holidays(hebrew_year):
+                if day.year == year:
+                    self.days.setdefault(day, []).append({"title": title, "date": day.isoformat()})
+        self.years.add(year)
+
+    def items_on(self, day):
+        if day.year not in self.years:
+            self._compute(day.year)
+        return self.days.get(day, [])
+
+    async def items_between(self, start, end):
+        items = []
+        day = start
+        while day <= end:
+            items.extend(self.items_on(day))
+            day += timedelta(days=1)
+        return items
+
+
+def verify(fixture_file):
+    with open(fixture_file, "r", encoding="utf-8") as fp:
+        fixture = json.load(fp)
+
+    calendar = HebrewCalendar(0, start_year=date.today().year)
+    mismatches = []
+    for item in fixture["items"]:
+        day = date.fromisoformat(item["date"][:10])
+        if item["title"] not in [local["title"] for local in calendar.items_on(day)]:
+            mismatches.append(item)
+    return mismatches
+
+
+if __name__ == "__main__":
+    failed = False
+    for fixture_file in sys.argv[1:]:
+        for item in verify(fixture_file):
+            failed = True
+            print(f'{fixture_file}: no "{item["title"]}" on {item["date"]}')
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,45 @@
+import json
+import re
+from datetime import date, timedelta
+
+
+class HolidayMatcher:
+    def __init__(self, holidays):
+        self.holidays = holidays
+        self.aliases = {}
+        for holiday in holidays:
+            for alias in holiday["aliases"]:
+                self.aliases[alias.lower()] = holiday
+
+        # Longest alias first so the alternation prefers "rosh hashanah" over "rosh hashana"
+        self.pattern = re.compile("|".join(re.escape(alias) for alias in
+                                           sorted(self.aliases, key=len, reverse=True)), re.IGNORECASE)
+        self.id_pattern = re.compile("|".join(r"\d{4}".join(re.escape(part) for part in
+                                                            holiday["id_template"].split("{year}"))
+                                              for holiday in holidays))
+        self.lead_days = max((holiday["lead_days"] for holiday in holidays), default=0)
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, "r", encoding="utf-8") as fp:
+            return cls(json.load(fp))
+
+    def match(self, title):
+        match = self.pattern.search(title)
+        if match is None:
+            return None
+        return self.aliases[match.group(0).lower()]
+
+    def active(self, items, today):
+        active = {}
+        for item in items:
+            holiday = self.match(item["title"])
+            if holiday is None:
+                continue
+
+            if date.fromisoformat(item["date"][:10]) <= today + timedelta(days=holiday["lead_days"]):
+                active[holiday["id_template"].format(year=today.year)] = holiday
+        return active
+
+    def is_holiday_id(self, id):
+        return self.id_pattern.fullmatch(id) is not None
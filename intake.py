@@ -0,0 +1,208 @@
+import asyncio
+import codecs
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    # Token bucket, Discord allows about 5 messages per 5 seconds in a channel
+    def __init__(self, rate=5, per=5.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+
+class SubmissionQueue:
+    def __init__(self, send, maxsize=1000, workers=2, limiter=None):
+        self.send = send
+        self.queue = asyncio.Queue(maxsize)
+        self.workers = workers
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.tasks = []
+
+    def submit(self, submission_id):
+        # Raises asyncio.QueueFull, the caller turns that into a 503
+        self.queue.put_nowait(submission_id)
+
+    async def put(self, submission_id):
+        await self.queue.put(submission_id)
+
+    def full(self):
+        return self.queue.full()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            submission_id = await self.queue.get()
+            try:
+                await self.limiter.acquire()
+                await self.send(submission_id)
+            except Exception as e:
+                print(f'Failed to send submission {submission_id}: {e!r}')
+            finally:
+                self.queue.task_done()
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+class PendingWatcher:
+    # With MODE=bot the web workers only write submissions to the pending store, this feeds them to the queue
+    def __init__(self, store, queue, interval=1.0):
+        self.store = store
+        self.queue = queue
+        self.interval = interval
+        self.queued = set()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        version = None
+        while True:
+            try:
+                version, batch_ids = await self.store.queued_since(version)
+                if batch_ids is not None:
+                    # Sent batches drop out of the list, so this only remembers what is still waiting
+                    self.queued &= set(batch_ids)
+                    for batch_id in batch_ids:
+                        if batch_id not in self.queued:
+                            self.queued.add(batch_id)
+                            await self.queue.put(batch_id)
+            except sqlite3.Error as e:
+                print(f'Failed to check for new submissions: {e!r}')
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+class RecentSubmissions:
+    # Content hash to submission id, so a double submit or a retry gets the id it was already given
+    def __init__(self, ttl=600, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        submission_id, expires = entry
+        if expires <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return submission_id
+
+    def add(self, key, submission_id):
+        now = time.monotonic()
+        self.entries[key] = (submission_id, now + self.ttl)
+        self.entries.move_to_end(key)
+        while self.entries:
+            oldest, (_, expires) = next(iter(self.entries.items()))
+            if len(self.entries) <= self.maxsize and expires > now:
+                break
+            del self.entries[oldest]
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+
+async def iter_records(chunks, max_record=64 * 1024):
+    # Yields (index, record, error) from an NDJSON or JSON array body without holding more than one record
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    buffer = ""
+    array = None
+    index = 0
+    finished = False
+
+    async for chunk in chunks:
+        if finished:
+            continue
+        buffer += decoder.decode(chunk)
+
+        if array is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            array = stripped[0] == "["
+            buffer = stripped[1:] if array else stripped
+
+        if array:
+            position = 0
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) and buffer[position] == "]":
+                    finished = True
+                    position = len(buffer)
+                    break
+                try:
+                    record, position = json_decoder.raw_decode(buffer, position)
+                except ValueError:
+                    break
+                yield index, record, None
+                index += 1
+            buffer = buffer[position:]
+        else:
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                if line.strip():
+                    try:
+                        yield index, json.loads(line), None
+                    except ValueError as e:
+                        yield index, None, str(e)
+                    index += 1
+
+        if len(buffer) > max_record:
+            yield index, None, "Record is larger than %d bytes" % max_record
+            return
+
+    buffer += decoder.decode(b"", final=True)
+    if array:
+        if not finished and buffer.strip():
+            try:
+                json_decoder.raw_decode(buffer.strip())
+            except ValueError as e:
+                yield index, None, str(e)
+        elif not finished:
+            yield index, None, "Unterminated JSON array"
+    elif buffer.strip():
+        try:
+            yield index, json.loads(buffer), None
+        except ValueError as e:
+            yield index, None, str(e)
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from loadtest.fakes import Discord, FakeChannel, FakeContext, FakeInteraction, install
+from loadtest.stubs import StubServer
+
+SCENARIOS = ("submit", "bulk", "approve", "banners", "feed", "holiday")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+async def measure(name, operations, concurrency):
+    # Runs the operations `concurrency` at a time and reports per operation latency
+    operations = iter(operations)
+    latencies = []
+    errors = []
+
+    async def worker():
+        for operation in operations:
+            start = time.perf_counter()
+            try:
+                await operation()
+            except Exception as e:
+                errors.append(repr(e))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    result = {
+        "name": name,
+        "count": len(latencies),
+        "errors": len(errors),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None
+    }
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def random_shul(index):
+    return {
+        "name": f"Load Test Shul {index}",
+        "rabbi": "Rabbi Test",
+        "nusach": "Ashkenaz",
+        "affiliation": "Orthodox",
+        "address": f"{index} Main St",
+        "city": "Teaneck",
+        "state": "NJ",
+        "zipcode": "07666",
+        "latitude": 40.89 + random.uniform(-0.5, 0.5),
+        "longitude": -74.01 + random.uniform(-0.5, 0.5)
+    }
+
+
+class LoadTest:
+    def __init__(self, main, channel, requests, concurrency, bulk_size):
+        self.main = main
+        self.channel = channel
+        self.requests = requests
+        self.concurrency = concurrency
+        self.bulk_size = bulk_size
+        self.client = main.app.test_client()
+        self.results = []
+
+    async def record(self, name, operations, concurrency=None):
+        result = await measure(name, operations, concurrency or self.concurrency)
+        self.results.append(result)
+        print_result(result)
+
+    async def drain(self, name, messages):
+        # Everything accepted over HTTP still has to go through the queue and out to "Discord"
+        start = time.perf_counter()
+        await self.main.shul_intake.queue.join()
+        seconds = time.perf_counter() - start
+        result = {"name": name, "count": len(self.channel.messages) - messages, "errors": 0,
+                  "seconds": round(seconds, 3)}
+        self.results.append(result)
+        print_result(result)
+
+    async def submit(self):
+        async def post(index):
+            resp = await self.client.post("/shuls", json=random_shul(index))
+            if resp.status_code != 202:
+                raise RuntimeError(f"/shuls answered {resp.status_code}")
+
+        messages = len(self.channel.messages)
+        await self.record("submit", (lambda index=index: post(index) for index in range(self.requests)))
+        await self.drain("submit_drain", messages)
+
+    async def bulk(self):
+        async def post(start):
+            body = "\n".join(json.dumps(random_shul(index)) for index in range(start, start + self.bulk_size))
+            resp = await self.client.post("/shuls/bulk", data=body)
+            if resp.status_code != 202:
+                raise RuntimeError(f"/shuls/bulk answered {resp.status_code}")
+
+        messages = len(self.channel.messages)
+        starts = range(0, self.requests, self.bulk_size)
+        await self.record("bulk", (lambda start=start: post(start) for start in starts))
+        await self.drain("bulk_drain", messages)
+
+    async def approve(self):
+        single = self.main.ShulView()
+        batch = self.main.ShulBatchView()
+
+        clicks = []
+        for message in list(self.channel.messages.values()):
+            if isinstance(message.view, self.main.ShulView):
+                clicks.append(lambda message=message: self.main.ShulView.approve(
+                    single, None, FakeInteraction(self.channel, message)))
+            elif isinstance(message.view, self.main.ShulBatchView):
+                for index in range(len(message.embeds)):
+                    clicks.append(lambda message=message, index=index: batch.approve(
+                        index, FakeInteraction(self.channel, message)))
+
+        await self.record("approve", clicks)
+
+    async def banners(self):
+        main = self.main
+        ids = [f"loadtest_{index}" for index in range(self.requests)]
+
+        await self.record("banner_add", (lambda id=id: main.add_banner_v2.callback(
+            FakeContext(self.channel), id=id, type="general", persistent=True, header="Load test",
+            content="Added", enabled=True, starts_at=None, ends_at=None) for id in ids))
+        await self.record("banner_edit", (lambda id=id: main.edit_banner_v2.callback(
+            FakeContext(self.channel), old_id=id, id=None, type="alert", persistent=None, header=None,
+            content="Edited", enabled=True, starts_at=None, ends_at=None) for id in ids))
+        await self.record("banner_delete", (lambda id=id: main.remove_banner.callback(
+            FakeContext(self.channel), version="V2", id=id) for id in ids))
+
+    async def feed(self):
+        async def get():
+            resp = await self.client.get("/banners/V2", headers={"Accept-Encoding": "gzip, br"})
+            if resp.status_code != 200:
+                raise RuntimeError(f"/banners/V2 answered {resp.status_code}")
+
+        await self.record("feed", (get for _ in range(self.requests)))
+
+    async def holiday(self):
+        runs = max(self.requests // 100, 1)
+        await self.record("holiday", (self.main.holiday_banners for _ in range(runs)), concurrency=1)
+
+
+def print_result(result):
+    line = f'{result["name"]:<14} {result["count"]:>7} ops {result["errors"]:>5} errors {result["seconds"]:>9.3f}s'
+    if "throughput" in result:
+        line += f' {result["throughput"]:>9} ops/s  p50 {result["p50_ms"]} ms  p99 {result["p99_ms"]} ms'
+    print(line)
+    if "first_error" in result:
+        print(f'{"":<14} first error: {result["first_error"]}')
+
+
+async def run(args):
+    stub = await StubServer(args.api_latency / 1000, args.failure_rate).start()
+    directory = tempfile.mkdtemp(prefix="shulert-loadtest-")
+
+    # main reads its configuration at import, so everything has to be pointed at the stand-ins first
+    os.environ.update({
+        "GUILD_ID": "1",
+        "CHANNEL_ID": "1",
+        "API_AUTH": "loadtest",
+        "V2_FILE": os.path.join(directory, "V2.json"),
+        "V1_FILE": os.path.join(directory, "V1.json"),
+        "BANNERS_FILE": os.path.join(directory, "banners.json"),
+        "DATABASE_FILE": os.path.join(directory, "shulert.db"),
+        "SHULS_SNAPSHOT_FILE": os.path.join(directory, "shuls-snapshot.ndjson"),
+        "HOLIDAYS_FILE": os.path.join(ROOT, "holidays.json"),
+        "HOLIDAY_BACKEND": "hebcal",
+        "HEBCAL_API": stub.url + "/hebcal?v=1&cfg=json&maj=on&lg=a",
+        "HEBCAL_CACHE_FILE": os.path.join(directory, "hebcal-cache.json"),
+        "SHULERT_ADD_API": stub.url + "/shul",
+        "BANNER_BACKEND": args.banner_backend,
+        "BANNER_MODEL": args.banner_model
+    })
+
+    import main
+    from intake import RateLimiter
+
+    channel = FakeChannel(Discord(args.discord_latency / 1000))
+    install(main.bot, channel)
+    if args.discord_rate:
+        main.shul_intake.limiter = RateLimiter(args.discord_rate, 1.0)
+    else:
+        main.shul_intake.limiter = RateLimiter(10 ** 9, 1.0)
+
+    main.banner_timer.start()
+    main.shulert.start()
+    main.shul_intake.start()
+
+    test = LoadTest(main, channel, args.requests, args.concurrency, args.bulk_size)
+    try:
+        for scenario in args.scenarios:
+            await getattr(test, scenario)()
+    finally:
+        await main.shul_intake.close()
+        await main.shulert.close()
+        await asyncio.gather(*(store.aflush() for store in main.banner_sources.values()))
+        main.pending_shuls.close()
+        await stub.close()
+        if args.keep:
+            print(f'Files kept in {directory}')
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "json"},
+        "discord_calls": channel.discord.calls,
+        "stub_requests": stub.requests,
+        "scenarios": test.results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m loadtest",
+                                     description="Drive the bot and web app against local stand-ins")
+    parser.add_argument("--requests", type=int, default=200, help="operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated, from %s" % ", ".join(SCENARIOS))
+    parser.add_argument("--bulk-size", type=int, default=100, help="shuls per /shuls/bulk request")
+    parser.add_argument("--discord-latency", type=float, default=50, help="ms per Discord call")
+    parser.add_argument("--discord-rate", type=float, default=0, help="messages per second, 0 for no limit")
+    parser.add_argument("--api-latency", type=float, default=30, help="ms per Hebcal or Shulert API call")
+    parser.add_argument("--failure-rate", type=float, default=0, help="fraction of Shulert API calls that 503")
+    parser.add_argument("--banner-backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--banner-model", choices=("split", "canonical"), default="split")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary files for a look afterwards")
+    args = parser.parse_args()
+
+    args.scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario {scenario}")
+
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=4)
+
+
+if __name__ == "__main__":
+    main()
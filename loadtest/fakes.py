@@ -0,0 +1,117 @@
+import asyncio
+import itertools
+
+ids = itertools.count(1)
+# Stands in for discord.utils.MISSING, edits leave whatever isn't passed alone
+MISSING = object()
+
+
+class Discord:
+    # Latency every call to "Discord" pays, roughly a REST round trip
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embeds=(), view=None, reference=None):
+        self.id = next(ids)
+        self.channel = channel
+        self.content = content
+        self.embeds = list(embeds)
+        self.view = view
+        self.reference = reference
+
+    # Keyword arguments are py-cord's own, so a call Discord wouldn't take fails here too
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, reference=self, **kwargs)
+
+    async def edit(self, content=MISSING, embed=MISSING, embeds=MISSING, file=MISSING, files=MISSING,
+                   attachments=MISSING, suppress=MISSING, suppress_embeds=MISSING, delete_after=None,
+                   allowed_mentions=MISSING, view=MISSING):
+        await self.channel.discord.call()
+        if content is not MISSING:
+            self.content = content
+        if embed is not MISSING:
+            self.embeds = [] if embed is None else [embed]
+        elif embeds is not MISSING:
+            self.embeds = list(embeds)
+        if view is not MISSING:
+            self.view = view
+
+    async def delete(self, *, delay=None, reason=None):
+        await self.channel.discord.call()
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeChannel:
+    def __init__(self, discord):
+        self.discord = discord
+        self.messages = {}
+
+    async def send(self, content=None, *, tts=None, embed=None, embeds=None, file=None, files=None, stickers=None,
+                   delete_after=None, nonce=None, enforce_nonce=None, allowed_mentions=None, reference=None,
+                   mention_author=None, view=None, poll=None, suppress=None, suppress_embeds=None, silent=None):
+        await self.discord.call()
+        message = FakeMessage(self, content, [embed] if embed is not None else embeds or (), view, reference)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, id):
+        await self.discord.call()
+        return self.messages[id]
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, *, ephemeral=False, invisible=True):
+        await self.interaction.channel.discord.call()
+
+    async def send_message(self, content=None, *, embed=None, embeds=None, view=None, tts=False, ephemeral=False,
+                           allowed_mentions=None, file=None, files=None, poll=None, delete_after=None, silent=False,
+                           suppress_embeds=False):
+        await self.interaction.channel.discord.call()
+
+    async def edit_message(self, *, content=MISSING, embed=MISSING, embeds=MISSING, file=MISSING, files=MISSING,
+                           attachments=MISSING, view=MISSING, delete_after=None, suppress=MISSING,
+                           allowed_mentions=None):
+        await self.interaction.message.edit(content=content, embed=embed, embeds=embeds, view=view)
+
+
+class FakeInteraction:
+    def __init__(self, channel, message=None):
+        self.id = next(ids)
+        self.channel = channel
+        self.message = message
+        self.response = FakeResponse(self)
+
+
+class FakeContext:
+    # What a slash command handler sees as ctx
+    def __init__(self, channel):
+        self.channel = channel
+        self.interaction = FakeInteraction(channel)
+        self.responses = []
+
+    async def respond(self, content=None, *, embed=None, embeds=None, view=None, tts=False, ephemeral=False,
+                      allowed_mentions=None, file=None, files=None, poll=None, delete_after=None, silent=False,
+                      suppress_embeds=False):
+        await self.channel.discord.call()
+        kwargs = {"embed": embed, "embeds": embeds, "view": view, "ephemeral": ephemeral, "file": file}
+        self.responses.append((content, {key: value for key, value in kwargs.items() if value}))
+
+
+def install(bot, channel):
+    # The handlers only reach Discord through these, everything else comes in as ctx or an interaction
+    async def wait_until_ready():
+        pass
+
+    bot.get_channel = lambda id: channel
+    bot.wait_until_ready = wait_until_ready
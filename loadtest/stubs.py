@@ -0,0 +1,62 @@
+import asyncio
+import itertools
+import random
+
+from aiohttp import web
+
+from hebrew_calendar import HebrewCalendar
+
+
+class StubServer:
+    # Stands in for Hebcal and the Shulert API on a local port
+    def __init__(self, latency=0.0, failure_rate=0.0, host="127.0.0.1"):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.host = host
+        self.ids = itertools.count(1)
+        self.calendars = {}
+        self.requests = {"hebcal": 0, "shul": 0}
+        self.runner = None
+        self.url = None
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def hebcal(self, request):
+        self.requests["hebcal"] += 1
+        await self._delay()
+
+        year = int(request.query["year"])
+        if year not in self.calendars:
+            days = HebrewCalendar(span=0, start_year=year).days
+            self.calendars[year] = [item for day in sorted(days) for item in days[day]]
+        return web.json_response({"items": self.calendars[year]})
+
+    async def shul(self, request):
+        self.requests["shul"] += 1
+        await request.json()
+        await self._delay()
+
+        if random.random() < self.failure_rate:
+            return web.json_response({"error": "Stub failure"}, status=503)
+        return web.json_response({"result": {"id": next(self.ids)}})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/hebcal", self.hebcal)
+        app.router.add_post("/shul", self.shul)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, 0)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{self.host}:{port}"
+        return self
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -1,37 +1,81 @@
 import asyncio
 import codecs
+import functools
+import io
 import json
 import os
 import re
 import sys
+import time
+import uuid
 from datetime import date, timedelta
 
 import aiohttp
 import discord
-import requests
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from discord import Option
 from dotenv import load_dotenv
+from hypercorn.config import Config
+from hypercorn.run import run as run_hypercorn
 from pytz import utc
 from quart import Quart
+from quart import Request
+from quart import Response
 from quart import request
 
+from banner_db import ChangeLog, SqliteBannerStore
+from banner_index import BannerIndex
+from banner_model import BannerProjection, blue, blue_types, green, green_types, red, red_types, type_color
+from banner_store import BannerFeed, BannerPublisher, BannerStore
+from banner_timer import BannerTimer, apply_schedule, format_time, parse_time
+from hebcal import HebcalClient
+from hebrew_calendar import HebrewCalendar
+from holiday_rules import HolidayMatcher
+from intake import PendingWatcher, RecentSubmissions, SubmissionQueue, iter_records
+from metrics import Counter, Gauge, Histogram, render
+from pending_store import PendingStore
+from shul_index import ShulIndex
+from shul_model import Shul, parse_shul
+from shulert_api import ShulertClient
+
 load_dotenv()
 
+
+class ShulertBot(discord.Bot):
+    async def close(self):
+        await asyncio.gather(*(store.aflush() for store in banner_sources.values()))
+        await asyncio.gather(*(publisher.apublish() for publisher in banner_publishers.values()))
+        await pending_watcher.close()
+        await shul_intake.close()
+        await shulert.close()
+        await super().close()
+        pending_shuls.close()
+        if banner_log is not None:
+            banner_log.close()
+        for store in banner_sources.values():
+            store.close()
+
+    async def on_application_command_error(self, context, exception):
+        command_finished(context, "error")
+        await super().on_application_command_error(context, exception)
+
+
+class ShulertRequest(Request):
+    # Quart sizes the body before any handler runs, so the bulk upload's larger cap has to be set here.
+    # Everything else keeps MAX_CONTENT_LENGTH (16 MB)
+    def __init__(self, method, scheme, path, *args, max_content_length=None, **kwargs):
+        if path == "/shuls/bulk":
+            max_content_length = bulk_max_content_length
+        super().__init__(method, scheme, path, *args, max_content_length=max_content_length, **kwargs)
+
+
 app = Quart(__name__)
-bot = discord.Bot()
+app.request_class = ShulertRequest
+bot = ShulertBot()
 
 guild_id = os.getenv("GUILD_ID")
 channel_id = os.getenv("CHANNEL_ID")
 
-red_types = ["red", "alert", "warning"]
-green_types = ["green", "update"]
-blue_types = ["blue", "general", "holiday"]
-
-red = "#E53E3E"
-green = "#48BB78"
-blue = "#5384D6"
-
 ESCAPE_SEQUENCE_RE = re.compile(r'''
     ( \\U........      # 8-digit hex escapes
     | \\u....          # 4-digit hex escapes
@@ -41,28 +85,75 @@ ESCAPE_SEQUENCE_RE = re.compile(r'''
     | \\[\\'"abfnrtv]  # Single-character escapes
     )''', re.UNICODE | re.VERBOSE)
 
-hebcal_api = "https://www.hebcal.com/hebcal?v=1&cfg=json&maj=on&lg=a"
-shulert_add_api = "https://api.shulert.com/v2/_shul"
+hebcal_api = os.getenv("HEBCAL_API", "https://www.hebcal.com/hebcal?v=1&cfg=json&maj=on&lg=a")
+shulert_add_api = os.getenv("SHULERT_ADD_API", "https://api.shulert.com/v2/_shul")
 shulert_shul = "https://www.shulert.com/shul/%s"
 
-
-class Shul:
-    def __init__(self, name, rabbi, nusach, affiliation, email, phone, website, address, city, state, zipcode, latitude,
-                 longitude):
-        super().__init__()
-        self.name = name
-        self.rabbi = rabbi
-        self.nusach = nusach
-        self.affiliation = affiliation
-        self.email = email
-        self.phone = phone
-        self.website = website
-        self.address = address
-        self.city = city
-        self.state = state
-        self.zipcode = zipcode
-        self.latitude = latitude
-        self.longitude = longitude
+# Ships with the code, so a relative path is taken from here rather than from wherever the bot was started
+holiday_matcher = HolidayMatcher.load(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   os.getenv("HOLIDAYS_FILE", "holidays.json")))
+if os.getenv("HOLIDAY_BACKEND", "hebcal") == "local":
+    holiday_calendar = HebrewCalendar(int(os.getenv("HEBREW_CALENDAR_YEARS", 10)))
+else:
+    holiday_calendar = HebcalClient(hebcal_api, os.getenv("HEBCAL_CACHE_FILE", "hebcal-cache.json"))
+
+database_file = os.getenv("DATABASE_FILE", "shulert.db")
+# single runs the bot and the web app in one process. Bigger installs run one MODE=bot process and MODE=web
+# (several hypercorn workers) beside it, the web side hands submissions over through DATABASE_FILE
+mode = os.getenv("MODE", "single")
+sqlite_banners = os.getenv("BANNER_BACKEND", "json") == "sqlite"
+if os.getenv("BANNER_MODEL", "split") == "canonical":
+    # One record per banner, V1 and V2 are projections of it
+    if sqlite_banners:
+        banner_sources = {"canonical": SqliteBannerStore(database_file, "canonical")}
+    else:
+        banner_sources = {"canonical": BannerStore(os.getenv("BANNERS_FILE", "banners.json"))}
+    banner_stores = {
+        "V2": BannerProjection(banner_sources["canonical"], "V2"),
+        "V1": BannerProjection(banner_sources["canonical"], "V1")
+    }
+else:
+    if sqlite_banners:
+        banner_stores = {
+            "V2": SqliteBannerStore(database_file, "V2"),
+            "V1": SqliteBannerStore(database_file, "V1")
+        }
+    else:
+        banner_stores = {
+            "V2": BannerStore(os.getenv("V2_FILE")),
+            "V1": BannerStore(os.getenv("V1_FILE"))
+        }
+    banner_sources = banner_stores
+banner_feeds = {version: BannerFeed(store) for version, store in banner_stores.items()}
+if mode == "web":
+    # Only the bot writes banners (and publishes them), a worker follows along and reads the bot's change log
+    for store in list(banner_sources.values()) + list(banner_stores.values()):
+        store.follower = True
+    banner_publishers = {}
+    banner_timer = None
+    banner_log = ChangeLog(database_file)
+else:
+    banner_publishers = {version: BannerPublisher(feed, os.getenv("%s_FILE" % version))
+                         for version, feed in banner_feeds.items() if os.getenv("%s_FILE" % version)}
+    banner_timer = BannerTimer(banner_sources)
+    banner_log = None
+    if mode == "bot":
+        banner_log = ChangeLog(database_file)
+        banner_log.record(banner_stores, banner_sources)
+banner_indexes = {version: BannerIndex(store) for version, store in banner_stores.items()}
+banner_pages = {}
+shulert = ShulertClient(os.getenv("API_AUTH"))
+shul_index = ShulIndex(os.getenv("SHULS_SNAPSHOT_FILE", "shuls-snapshot.ndjson"))
+pending_shuls = PendingStore(database_file)
+
+command_seconds = Histogram("shulert_command_seconds", "Slash command handling time", ("command", "outcome"))
+http_seconds = Histogram("shulert_http_seconds", "HTTP request handling time", ("route",))
+holiday_seconds = Histogram("shulert_holiday_banners_seconds", "Nightly holiday banner run time")
+discord_send_seconds = Histogram("shulert_discord_send_seconds", "Time to post a shul for review", ("kind",))
+shuls_received = Counter("shulert_shuls_received_total", "Shuls submitted over HTTP", ("outcome",))
+intake_depth = Gauge("shulert_intake_queue_depth", "Submissions waiting to be posted to Discord",
+                     lambda: shul_intake.qsize())
+command_started = {}
 
 
 def decode_escapes(s):
@@ -75,12 +166,63 @@ def decode_escapes(s):
         return None
 
 
+def banner_ids(version=None):
+    def autocomplete(ctx: discord.AutocompleteContext):
+        return banner_indexes[version or ctx.options.get("version") or "V2"].search(ctx.value or "")
+
+    return autocomplete
+
+
+def missing_banner_embed(id):
+    return discord.Embed(title="Error", description="No banner with the ID `%s`" % id)
+
+
+restored = False
+
+
 @bot.event
 async def on_ready():
+    global restored
+
+    banner_timer.start()
+    shulert.start()
+    shul_intake.start()
+    if mode == "bot":
+        pending_watcher.start()
+
+    # on_ready fires again after every reconnect, only register the persistent views once
+    if not restored:
+        restored = True
+        bot.add_view(ShulView())
+        bot.add_view(ShulBatchView())
+        for version in banner_stores:
+            bot.add_view(Modify(version))
+        bot.add_view(BannerPages())
+        for publisher in banner_publishers.values():
+            # Catch up on edits made while we were down, skipped if the manifest already matches
+            asyncio.create_task(publisher.apublish())
+        asyncio.create_task(restore_pending())
+
     print(f'Logged in as {bot.user} (ID: {bot.user.id})')
     print('------')
 
 
+@bot.listen()
+async def on_application_command(ctx):
+    command_started[ctx.interaction.id] = time.perf_counter()
+
+
+@bot.listen()
+async def on_application_command_completion(ctx):
+    command_finished(ctx, "ok")
+
+
+def command_finished(ctx, outcome):
+    started = command_started.pop(ctx.interaction.id, None)
+    if started is not None:
+        command_seconds.observe(time.perf_counter() - started, command=ctx.command.qualified_name, outcome=outcome)
+
+
 @bot.slash_command(
     name="add_banner_v2",
     description="Add a banner to the Shulert app V2",
@@ -95,7 +237,9 @@ async def add_banner_v2(ctx,
                         persistent: Option(bool, "Banner persistence", required=True),
                         header: Option(str, "Banner header", required=True),
                         content: Option(str, "Banner content", required=True),
-                        enabled: Option(bool, "Banner enabled state", default=True)
+                        enabled: Option(bool, "Banner enabled state", default=True),
+                        starts_at: Option(str, "Go live at (ISO 8601, UTC unless an offset is given)", required=False),
+                        ends_at: Option(str, "Take down at (ISO 8601, UTC unless an offset is given)", required=False)
                         ):
     header = decode_escapes(header)
     content = decode_escapes(content)
@@ -111,11 +255,20 @@ async def add_banner_v2(ctx,
     if not enabled:
         json_text["enabled"] = enabled
 
+    try:
+        schedule_banner(json_text, starts_at, ends_at)
+    except ValueError:
+        await ctx.respond(embed=discord.Embed(title="Error", description="Times look like `2024-03-24 18:00` or "
+                                                                         "`2024-03-24T18:00:00-04:00`"),
+                          ephemeral=True)
+        return
+
     json_text = add_edit_banner_json(json_text, "V2")
 
     embed = discord_embed(id=json_text["id"], color=json_text["type"], content=json_text["content"],
                           enabled=json_text.get("enabled", True), header=json_text["header"],
-                          persistent=json_text["persistent"])
+                          persistent=json_text["persistent"], starts_at=json_text.get("starts_at"),
+                          ends_at=json_text.get("ends_at"))
     await ctx.respond(embed=embed)
 
 
@@ -125,7 +278,8 @@ async def add_banner_v2(ctx,
     guild_ids=[guild_id]
 )
 async def edit_banner_v2(ctx,
-                         old_id: Option(str, "Old Banner ID (unique)", required=True),
+                         old_id: Option(str, "Old Banner ID (unique)", required=True,
+                                        autocomplete=banner_ids("V2")),
                          id: Option(str, "Banner ID (unique)", required=False),
                          type: Option(str, "Banner type",
                                       choices=
@@ -134,7 +288,11 @@ async def edit_banner_v2(ctx,
                          persistent: Option(bool, "Banner persistence", required=False),
                          header: Option(str, "Banner header", required=False),
                          content: Option(str, "Banner content", required=False),
-                         enabled: Option(bool, "Banner enabled state", default=True)
+                         enabled: Option(bool, "Banner enabled state", default=True),
+                         starts_at: Option(str, "Go live at (ISO 8601, UTC unless an offset is given), none to clear",
+                                           required=False),
+                         ends_at: Option(str, "Take down at (ISO 8601, UTC unless an offset is given), none to clear",
+                                         required=False)
                          ):
     header = decode_escapes(header)
     content = decode_escapes(content)
@@ -150,11 +308,29 @@ async def edit_banner_v2(ctx,
     if not enabled:
         json_text["enabled"] = enabled
 
+    try:
+        schedule_banner(json_text, starts_at, ends_at)
+    except ValueError:
+        await ctx.respond(embed=discord.Embed(title="Error", description="Times look like `2024-03-24 18:00` or "
+                                                                         "`2024-03-24T18:00:00-04:00`"),
+                          ephemeral=True)
+        return
+
+    if banner_stores["V2"].get(old_id) is None:
+        await ctx.respond(embed=missing_banner_embed(old_id), ephemeral=True)
+        return
+    if id is not None and banner_stores["V2"].collides(id, old_id):
+        await ctx.respond(embed=discord.Embed(title="Error",
+                                              description="There's already a banner with the ID `%s`" % id),
+                          ephemeral=True)
+        return
+
     json_text = add_edit_banner_json(json_text, "V2", old_id)
 
     embed = discord_embed(id=json_text["id"], color=json_text["type"], content=json_text["content"],
                           enabled=json_text.get("enabled", True), header=json_text["header"],
-                          persistent=json_text["persistent"])
+                          persistent=json_text["persistent"], starts_at=json_text.get("starts_at"),
+                          ends_at=json_text.get("ends_at"))
     await ctx.respond(embed=embed)
 
 
@@ -164,24 +340,24 @@ async def edit_banner_v2(ctx,
     guild_ids=[guild_id]
 )
 async def edit_banner_v1(ctx,
-                         old_id: Option(str, "Old Banner ID (unique)", required=True),
+                         old_id: Option(str, "Old Banner ID (unique)", required=True,
+                                        autocomplete=banner_ids("V1")),
                          id: Option(str, "Banner ID (unique)", required=False),
                          content: Option(str, "Banner content", required=False),
                          type: Option(str, "Banner type",
                                       choices=
                                       ["red", "alert", "warning", "green", "update", "blue", "general", "holiday"],
                                       required=False),
-                         enabled: Option(bool, "Banner enabled state", default=True)
+                         enabled: Option(bool, "Banner enabled state", default=True),
+                         starts_at: Option(str, "Go live at (ISO 8601, UTC unless an offset is given), none to clear",
+                                           required=False),
+                         ends_at: Option(str, "Take down at (ISO 8601, UTC unless an offset is given), none to clear",
+                                         required=False)
                          ):
     content = decode_escapes(content)
 
-    color = blue
-    if type in red_types:
-        color = red
-    elif type in green_types:
-        color = green
-    elif type in blue_types:
-        color = blue
+    # Left out, the edit keeps the old color
+    color = None if type is None else type_color(type)
 
     json_text = {
         "id": id,
@@ -197,10 +373,28 @@ async def edit_banner_v1(ctx,
     if not enabled:
         json_text["enabled"] = enabled
 
+    try:
+        schedule_banner(json_text, starts_at, ends_at)
+    except ValueError:
+        await ctx.respond(embed=discord.Embed(title="Error", description="Times look like `2024-03-24 18:00` or "
+                                                                         "`2024-03-24T18:00:00-04:00`"),
+                          ephemeral=True)
+        return
+
+    if banner_stores["V1"].get(old_id) is None:
+        await ctx.respond(embed=missing_banner_embed(old_id), ephemeral=True)
+        return
+    if id is not None and banner_stores["V1"].collides(id, old_id):
+        await ctx.respond(embed=discord.Embed(title="Error",
+                                              description="There's already a banner with the ID `%s`" % id),
+                          ephemeral=True)
+        return
+
     json_text = add_edit_banner_json(json_text, "V1", old_id)
 
     embed = discord_embed(id=json_text["id"], color=json_text["style"]["color"], content=json_text["title"],
-                          enabled=json_text.get("enabled", True), version="V1")
+                          enabled=json_text.get("enabled", True), version="V1", starts_at=json_text.get("starts_at"),
+                          ends_at=json_text.get("ends_at"))
     await ctx.respond(embed=embed)
 
 
@@ -216,17 +410,13 @@ async def add_banner_v1(ctx,
                                      choices=
                                      ["red", "alert", "warning", "green", "update", "blue", "general", "holiday"],
                                      required=True),
-                        enabled: Option(bool, "Banner ", default=True)
+                        enabled: Option(bool, "Banner ", default=True),
+                        starts_at: Option(str, "Go live at (ISO 8601, UTC unless an offset is given)", required=False),
+                        ends_at: Option(str, "Take down at (ISO 8601, UTC unless an offset is given)", required=False)
                         ):
     content = decode_escapes(content)
 
-    color = blue
-    if type in red_types:
-        color = red
-    elif type in green_types:
-        color = green
-    elif type in blue_types:
-        color = blue
+    color = type_color(type)
 
     json_text = {
         "id": id,
@@ -242,116 +432,303 @@ async def add_banner_v1(ctx,
     if not enabled:
         json_text["enabled"] = enabled
 
+    try:
+        schedule_banner(json_text, starts_at, ends_at)
+    except ValueError:
+        await ctx.respond(embed=discord.Embed(title="Error", description="Times look like `2024-03-24 18:00` or "
+                                                                         "`2024-03-24T18:00:00-04:00`"),
+                          ephemeral=True)
+        return
+
     json_text = add_edit_banner_json(json_text, "V1")
 
     embed = discord_embed(id=json_text["id"], color=json_text["style"]["color"], content=json_text["title"],
-                          enabled=json_text.get("enabled", True), version="V1")
+                          enabled=json_text.get("enabled", True), version="V1", starts_at=json_text.get("starts_at"),
+                          ends_at=json_text.get("ends_at"))
     await ctx.respond(embed=embed)
 
 
+def rendered(view):
+    # Only draws the buttons, clicks are handled by the persistent view registered in on_ready
+    view.stop()
+    return view
+
+
 class Modify(discord.ui.View):
-    def __init__(self, version, banner, view_banners_message: discord.Message):
-        super().__init__()
+    def __init__(self, version):
+        super().__init__(timeout=None)
         self.version = version
-        self.banner = banner
-        self.view_banners_message = view_banners_message
 
-    @discord.ui.button(label="Delete", style=discord.ButtonStyle.danger)
-    async def delete(self, button: discord.ui.Button, interaction: discord.Interaction):
-        self.stop()
+        button = discord.ui.Button(label="Delete", style=discord.ButtonStyle.danger,
+                                   custom_id="banner_delete:%s" % version)
+        button.callback = self.delete
+        self.add_item(button)
 
-        await interaction.message.reply(embed=discord.Embed(title="Deleted `%s`" % self.banner["id"]))
+    async def delete(self, interaction: discord.Interaction):
+        id = interaction.message.embeds[0].author.name
+        reference = interaction.message.reference
+
+        await interaction.message.reply(embed=discord.Embed(title="Deleted `%s`" % id))
         await interaction.message.delete()
 
-        delete_banner(self.version, self.banner)
+        banner = banner_stores[self.version].get(id)
+        if banner is not None:
+            delete_banner(self.version, banner)
+
+        if reference is not None:
+            try:
+                view_banners_message = await interaction.channel.fetch_message(reference.message_id)
+            except discord.NotFound:
+                return
+
+            response = view_banners_embed(**page_state(view_banners_message))
+            await view_banners_message.edit(content=response[0], view=response[1])
+
+
+class BannerPages(discord.ui.View):
+    page_size = 20
+
+    def __init__(self, state=None, banners=(), pages=1):
+        super().__init__(timeout=None)
+
+        # Without a state this is the persistent view every banner list's buttons are routed to
+        slots = range(self.page_size) if state is None else range(len(banners))
+        for slot in slots:
+            label = slot if state is None else state["page"] * self.page_size + slot
+            button = discord.ui.Button(label=label, style=discord.enums.ButtonStyle.primary, row=slot // 5,
+                                       custom_id="banners:open:%s" % slot)
+            button.callback = functools.partial(self.open, slot)
+            self.add_item(button)
+
+        page = 0 if state is None else state["page"]
+        previous = discord.ui.Button(label="Previous", row=4, custom_id="banners:previous", disabled=page == 0)
+        previous.callback = functools.partial(self.turn, -1)
+        self.add_item(previous)
+
+        if state is not None:
+            # Disabled, so never clicked, it only carries the list's state for the persistent view to read back
+            self.add_item(discord.ui.Button(label="%s/%s" % (page + 1, pages), row=4, disabled=True,
+                                            custom_id=encode_page_state(state)))
+
+        following = discord.ui.Button(label="Next", row=4, custom_id="banners:next",
+                                      disabled=state is not None and page + 1 >= pages)
+        following.callback = functools.partial(self.turn, 1)
+        self.add_item(following)
+
+    async def turn(self, step, interaction: discord.Interaction):
+        state = page_state(interaction.message)
+        state["page"] += step
+
+        response = view_banners_embed(**state)
+        await interaction.response.edit_message(content=response[0], view=response[1])
+
+    async def open(self, slot, interaction: discord.Interaction):
+        state = page_state(interaction.message)
+        banners = filtered_banners(state["version"], state["type"], state["enabled"])
+        if state["revision"] != banner_stores[state["version"]].revision:
+            # The list changed since it was drawn, the slot may point at a different banner now
+            response = view_banners_embed(**state)
+            await interaction.response.edit_message(content=response[0], view=response[1])
+            return
+
+        banner = banners[state["page"] * self.page_size + slot]
+        if state["version"] == "V2":
+            color = banner["type"]
+            content = banner["content"]
+        else:
+            color = banner["style"]["color"]
+            content = banner["title"]
+
+        embed = discord_embed(banner["id"], color, content, banner.get("enabled", True), banner.get("header", ""),
+                              banner.get("persistent", True), starts_at=banner.get("starts_at"),
+                              ends_at=banner.get("ends_at"))
+        # A reply, so the delete button can find the list to refresh even after a restart
+        await interaction.response.defer()
+        await interaction.message.reply(embed=embed, view=rendered(Modify(state["version"])))
+
+
+def encode_page_state(state):
+    enabled = "" if state["enabled"] is None else int(state["enabled"])
+    return "banners:state:%s:%s:%s:%s:%s" % (state["version"], state["page"], state["revision"],
+                                             state["type"] or "", enabled)
+
+
+def page_state(message):
+    for row in message.components:
+        for component in getattr(row, "children", ()):
+            custom_id = getattr(component, "custom_id", None) or ""
+            if custom_id.startswith("banners:state:"):
+                version, page, revision, type, enabled = custom_id.split(":")[2:]
+                return {
+                    "version": version,
+                    "page": int(page),
+                    "revision": int(revision),
+                    "type": type or None,
+                    "enabled": None if enabled == "" else enabled == "1"
+                }
+    return {"version": "V2", "page": 0, "revision": -1, "type": None, "enabled": None}
+
+
+async def approve_shul(shul, idempotency_key, message):
+    json_text = {
+        "shul": {
+            "name": shul.name,
+            "affiliation": shul.affiliation,
+            "nusach": shul.nusach,
+            "address": shul.address,
+            "city": shul.city,
+            "state": shul.state,
+            "zipcode": shul.zipcode,
+            "latitude": shul.latitude,
+            "longitude": shul.longitude,
+        }
+    }
 
-        response = view_banners_embed(self.version)
-        await self.view_banners_message.edit(content=response[0], view=response[1])
+    if shul.rabbi:
+        json_text["shul"]["rabbi"] = shul.rabbi
+    if shul.phone:
+        json_text["shul"]["phone"] = shul.phone
+    if shul.email:
+        json_text["shul"]["email"] = shul.email
+    if shul.website:
+        json_text["shul"]["website"] = shul.website
 
+    try:
+        status, json_resp = await shulert.post(shulert_add_api, json_text, idempotency_key)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        await message.reply(embed=discord.Embed(title="Error", description="`%r`" % e))
+        return False
+
+    if status == 200:
+        await shul_index.approve(shul, idempotency_key)
+        await message.reply(embed=discord.Embed(title="Approved `%s` - %s" %
+                                                      (shul.name, shulert_shul % json_resp["result"]["id"])))
+        return True
+    else:
+        json_code_block = """
+```json
+%s
+```"""
 
-class BannerButton(discord.ui.Button):
-    def __init__(self, banner, index, version):
-        self.banner = banner
-        self.version = version
-        super().__init__(
-            label=index,
-            style=discord.enums.ButtonStyle.primary,
-            custom_id=banner["id"],
-        )
-
-    async def callback(self, interaction: discord.Interaction):
-        id = self.banner["id"]
-
-        if self.version == "V2":
-            color = self.banner["type"]
-            content = self.banner["content"]
-        else:
-            color = self.banner["style"]["color"]
-            content = self.banner["title"]
+        await message.reply(embed=discord.Embed(title="Error",
+                                                description=json_code_block % json.dumps(json_resp, indent=2) +
+                                                            json_code_block % json.dumps(json_text, indent=2)))
+        return False
 
-        enabled = self.banner.get("enabled", True)
-        header = self.banner.get("header", "")
-        persistent = self.banner.get("persistent", True)
 
-        view = Modify(self.version, self.banner, interaction.message)
-        embed = discord_embed(id, color, content, enabled, header, persistent)
-        await interaction.response.send_message(embed=embed, view=view)
+async def already_handled(interaction: discord.Interaction):
+    await interaction.response.send_message("This submission was already handled", ephemeral=True)
 
 
 class ShulView(discord.ui.View):
-    def __init__(self, shul):
-        super().__init__()
-        self.shul = shul
+    def __init__(self):
+        super().__init__(timeout=None)
 
-    @discord.ui.button(label="Approve", style=discord.ButtonStyle.green)
+    @discord.ui.button(label="Approve", style=discord.ButtonStyle.green, custom_id="shul:approve")
     async def approve(self, button: discord.ui.Button, interaction: discord.Interaction):
-        self.stop()
+        rows = await pending_shuls.message(interaction.message.id)
+        if not rows:
+            await already_handled(interaction)
+            return
+
+        # Retries against the Shulert API can take longer than the 3 seconds Discord waits for an answer
+        await interaction.response.defer()
+        # The submission id doubles as the idempotency key, so a repeated approval never creates the shul twice
+        if await approve_shul(Shul.from_json(rows[0]["shul"]), rows[0]["id"], interaction.message):
+            await pending_shuls.remove([rows[0]["id"]])
+            await interaction.message.delete()
+
+    @discord.ui.button(label="Deny", style=discord.ButtonStyle.danger, custom_id="shul:deny")
+    async def deny(self, button: discord.ui.Button, interaction: discord.Interaction):
+        rows = await pending_shuls.message(interaction.message.id)
+        if not rows:
+            await already_handled(interaction)
+            return
+
+        await interaction.response.defer()
+        shul_index.remove(rows[0]["id"])
+        await pending_shuls.remove([rows[0]["id"]])
+        await interaction.message.reply(embed=discord.Embed(title="Denied `%s`" % rows[0]["shul"]["name"]))
+
+
+class ShulBatchView(discord.ui.View):
+    def __init__(self, rows=None):
+        super().__init__(timeout=None)
+
+        # Without rows this is the persistent view that every batch message's buttons are routed to
+        statuses = ["pending"] * 10 if rows is None else [row["status"] for row in rows]
+        for index, status in enumerate(statuses):
+            # Two shuls per row keeps 10 shuls inside Discord's 5 rows of 5 components
+            if status in ("queued", "pending"):
+                approve = discord.ui.Button(label="Approve %s" % (index + 1), style=discord.ButtonStyle.green,
+                                            row=index // 2, custom_id="shul_batch:approve:%s" % index)
+                deny = discord.ui.Button(label="Deny %s" % (index + 1), style=discord.ButtonStyle.danger,
+                                         row=index // 2, custom_id="shul_batch:deny:%s" % index)
+                approve.callback = functools.partial(self.approve, index)
+                deny.callback = functools.partial(self.deny, index)
+                self.add_item(approve)
+                self.add_item(deny)
+            else:
+                self.add_item(discord.ui.Button(label="%s %s" % (status.capitalize(), index + 1), disabled=True,
+                                                row=index // 2, custom_id="shul_batch:approve:%s" % index))
+
+    async def find_row(self, index, interaction: discord.Interaction):
+        rows = await pending_shuls.message(interaction.message.id)
+        for row in rows:
+            if row["position"] == index and row["status"] == "pending":
+                return row
+
+        await already_handled(interaction)
+        return None
 
-        json_text = {
-            "shul": {
-                "name": self.shul.name,
-                "affiliation": self.shul.affiliation,
-                "nusach": self.shul.nusach,
-                "address": self.shul.address,
-                "city": self.shul.city,
-                "state": self.shul.state,
-                "zipcode": self.shul.zipcode,
-                "latitude": self.shul.latitude,
-                "longitude": self.shul.longitude,
-            }
-        }
+    async def approve(self, index, interaction: discord.Interaction):
+        row = await self.find_row(index, interaction)
+        if row is None:
+            return
 
-        if self.shul.rabbi:
-            json_text["shul"]["rabbi"] = self.shul.rabbi
-        if self.shul.phone:
-            json_text["shul"]["phone"] = self.shul.phone
-        if self.shul.email:
-            json_text["shul"]["email"] = self.shul.email
-        if self.shul.website:
-            json_text["shul"]["website"] = self.shul.website
-
-        async with aiohttp.ClientSession(headers={"Authorization": os.getenv("API_AUTH")}) as session:
-            async with session.post(shulert_add_api, json=json_text) as resp:
-                json_resp = await resp.json()
-                if resp.status == 200:
-                    await interaction.message.reply(embed=discord.Embed(title="Approved `%s` - %s" %
-                                                                              (self.shul.name,
-                                                                               shulert_shul % json_resp["result"]["id"])),
-                                                    ephemeral=True)
-                    await interaction.message.delete()
-                else:
-                    json_code_block = """
-```json
-%s
-```"""
+        await interaction.response.defer()
+        if await approve_shul(Shul.from_json(row["shul"]), row["id"], interaction.message):
+            await self.resolve(row, "approved", interaction)
 
-                    await interaction.message.reply(embed=discord.Embed(title="Error",
-                                                                        description=json_code_block % json.dumps(json_resp, indent=2) +
-                                                                                    json_code_block % json.dumps(json_text, indent=2)))
+    async def deny(self, index, interaction: discord.Interaction):
+        row = await self.find_row(index, interaction)
+        if row is None:
+            return
 
-    @discord.ui.button(label="Deny", style=discord.ButtonStyle.danger)
-    async def deny(self, button: discord.ui.Button, interaction: discord.Interaction):
-        await interaction.message.reply(embed=discord.Embed(title="Denied `%s`" % self.shul.name))
+        await interaction.response.defer()
+        shul_index.remove(row["id"])
+        await interaction.message.reply(embed=discord.Embed(title="Denied `%s`" % row["shul"]["name"]))
+        await self.resolve(row, "denied", interaction)
+
+    async def resolve(self, row, status, interaction: discord.Interaction):
+        # Other items may have been handled while the API call ran, so mark ours first and then go by what the
+        # batch looks like now. Whichever click sees nothing left pending clears the batch
+        await pending_shuls.resolve(row["id"], status)
+        rows = await pending_shuls.message(interaction.message.id)
+        if all(other["status"] != "pending" for other in rows):
+            await pending_shuls.remove([other["id"] for other in rows])
+
+        await interaction.message.edit(view=rendered(ShulBatchView(rows)))
+
+
+@bot.slash_command(
+    name="delete_banner",
+    description="Delete a banner from the Shulert app",
+    guild_ids=[guild_id]
+)
+async def remove_banner(ctx,
+                        version: Option(str, "Banner version",
+                                        choices=
+                                        ["V2", "V1"],
+                                        required=True),
+                        id: Option(str, "Banner ID", required=True, autocomplete=banner_ids())):
+    banner = banner_stores[version].get(id)
+    if banner is None:
+        await ctx.respond(embed=missing_banner_embed(id), ephemeral=True)
+        return
+
+    delete_banner(version, banner)
+    await ctx.respond(embed=discord.Embed(title="Deleted `%s`" % id))
 
 
 @bot.slash_command(
@@ -363,107 +740,239 @@ async def view_banners(ctx,
                        version: Option(str, "Banner version",
                                        choices=
                                        ["V2", "V1"],
-                                       required=True)):
-    response = view_banners_embed(version)
+                                       required=True),
+                       type: Option(str, "Only banners of this type",
+                                    choices=
+                                    ["red", "alert", "warning", "green", "update", "blue", "general", "holiday"],
+                                    required=False),
+                       enabled: Option(bool, "Only enabled or disabled banners", required=False)):
+    response = view_banners_embed(version, type=type, enabled=enabled)
 
     await ctx.respond(response[0], view=response[1])
 
 
-def holiday_banners():
-    holidays = {
-        "rosh hashana": {
-            "header": "Happy Rosh Hashanah!",
-            "content": "Wishing you a happy, healthy and sweet New Year!"
-        },
-        "sukkos": {
-            "header": "Happy Succos!",
-            "content": "Wishing you a happy and healthy Succos!"
-        },
-        "chanukah": {
-            "header": "Happy Chanukah!",
-            "content": "Wishing you a happy and healthy Chanukah!"
-        },
-        "tu bishvat": {
-            "header": "Happy Tu B'Shvat!",
-            "content": "Wishing you a happy and healthy Tu B'Shvat!"
-        },
-        "purim": {
-            "header": "Happy Purim!",
-            "content": "Wishing you a happy and healthy Purim!"
-        },
-        "pesach": {
-            "header": "Happy Pesach!",
-            "content": "Wishing you a happy and healthy Pesach!"
-        },
-        "lag baomer": {
-            "header": "Happy Lag B'Omer!",
-            "content": "Wishing you a happy and healthy Lag B'Omer!"
-        },
-        "shavuos": {
-            "header": "Happy Shavuos!",
-            "content": "Wishing you a happy and healthy Shavuos!"
-        }
-    }
+@bot.slash_command(
+    name="export_banners",
+    description="Download the banners in the Shulert app as JSON",
+    guild_ids=[guild_id]
+)
+async def export_banners(ctx,
+                         version: Option(str, "Banner version",
+                                         choices=
+                                         ["V2", "V1"],
+                                         required=True)):
+    body = json.dumps(banner_stores[version].snapshot(), indent=4, ensure_ascii=False).encode("utf-8")
+    await ctx.respond(file=discord.File(io.BytesIO(body), filename="%s-banners.json" % version))
 
+
+@bot.slash_command(
+    name="import_banners",
+    description="Replace the banners in the Shulert app with a JSON file, previewed before anything changes",
+    guild_ids=[guild_id]
+)
+async def import_banners(ctx,
+                         version: Option(str, "Banner version",
+                                         choices=
+                                         ["V2", "V1"],
+                                         required=True),
+                         file: Option(discord.Attachment, "JSON file, as export_banners makes it", required=True)):
+    if file.size > max_import_size:
+        await ctx.respond(embed=discord.Embed(title="Error", description="Files are limited to %d MB" %
+                                                                         (max_import_size // 1024 // 1024)),
+                          ephemeral=True)
+        return
+
+    banners, error = parse_banner_import(version, await file.read())
+    if error is not None:
+        await ctx.respond(embed=discord.Embed(title="Error", description=error), ephemeral=True)
+        return
+
+    store = banner_stores[version]
+    store.refresh()
+    added, changed, removed = diff_banners(store, banners)
+    if not (added or changed or removed):
+        await ctx.respond(embed=discord.Embed(title="Nothing to import",
+                                              description="The file matches the %s banners" % version),
+                          ephemeral=True)
+        return
+
+    await ctx.respond(embed=import_embed("Import into %s?" % version, added, changed, removed),
+                      view=ImportBanners(version, banners, store.revision))
+
+
+max_import_size = 8 * 1024 * 1024
+import_fields = {
+    "V2": (("id", str), ("type", str), ("persistent", bool), ("header", str), ("content", str)),
+    "V1": (("id", str), ("title", str), ("style", dict))
+}
+
+
+def parse_banner_import(version, body):
+    # Returns (banners, None) or (None, error), banners normalized the way add_edit_banner_json stores them
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        return None, "Not valid JSON: `%s`" % e
+
+    if isinstance(data, dict):
+        data = data.get("banners")
+    if not isinstance(data, list):
+        return None, "Expected a list of banners, or an object with a `banners` list"
+
+    banners = {}
+    for index, banner in enumerate(data):
+        if not isinstance(banner, dict):
+            return None, "Banner %d isn't a JSON object" % (index + 1)
+        for field, kind in import_fields[version]:
+            if not isinstance(banner.get(field), kind):
+                return None, "Banner %d needs `%s`" % (index + 1, field)
+        if version == "V2" and banner["type"] not in red_types + green_types + blue_types:
+            return None, "Banner `%s` has an unknown type `%s`" % (banner["id"], banner["type"])
+        if version == "V1" and not isinstance(banner["style"].get("color"), str):
+            return None, "Banner `%s` needs `style.color`" % banner["id"]
+        if banner["id"] in banners:
+            return None, "Banner ID `%s` is used more than once" % banner["id"]
+
+        banner = dict(banner)
+        try:
+            for field in ("starts_at", "ends_at"):
+                if banner.get(field) is not None:
+                    banner[field] = format_time(parse_time(banner[field]))
+                else:
+                    banner.pop(field, None)
+        except (TypeError, ValueError):
+            return None, "Banner `%s` has a start or end time that isn't ISO 8601" % banner["id"]
+        banners[banner["id"]] = apply_schedule(banner)
+    return list(banners.values()), None
+
+
+def diff_banners(store, banners):
+    current = {banner["id"]: banner for banner in store.all()}
+    ids = {banner["id"] for banner in banners}
+    added = [banner["id"] for banner in banners if banner["id"] not in current]
+    changed = [banner["id"] for banner in banners if banner["id"] in current and current[banner["id"]] != banner]
+    removed = [id for id in current if id not in ids]
+    return added, changed, removed
+
+
+def import_embed(title, added, changed, removed):
+    embed = discord.Embed(title=title)
+    for name, ids in (("Added", added), ("Changed", changed), ("Removed", removed)):
+        listed = ", ".join("`%s`" % id for id in ids[:20])
+        if len(ids) > 20:
+            listed += " and %d more" % (len(ids) - 20)
+        embed.add_field(name="%s: %d" % (name, len(ids)), value=listed or "-", inline=False)
+    return embed
+
+
+def import_banners_json(version, banners, removed):
+    store = banner_stores[version]
+    # One transaction, and one debounced file write, however many banners change. A failure part way
+    # through rolls the whole import back
+    with store.transaction():
+        for id in removed:
+            store.delete(id)
+        for banner in banners:
+            if store.get(banner["id"]) != banner:
+                store.put(banner)
+
+
+class ImportBanners(discord.ui.View):
+    def __init__(self, version, banners, revision):
+        super().__init__(timeout=600, disable_on_timeout=True)
+        self.version = version
+        self.banners = banners
+        self.revision = revision
+
+    @discord.ui.button(label="Import", style=discord.ButtonStyle.green)
+    async def confirm(self, button: discord.ui.Button, interaction: discord.Interaction):
+        self.stop()
+        store = banner_stores[self.version]
+        store.refresh()
+        if store.revision != self.revision:
+            await interaction.response.edit_message(
+                embed=discord.Embed(title="Import cancelled",
+                                    description="The %s banners changed since this preview, run "
+                                                "`/import_banners` again" % self.version),
+                view=None)
+            return
+
+        added, changed, removed = diff_banners(store, self.banners)
+        import_banners_json(self.version, self.banners, removed)
+        await interaction.response.edit_message(
+            embed=import_embed("Imported into %s" % self.version, added, changed, removed), view=None)
+
+    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.secondary)
+    async def cancel(self, button: discord.ui.Button, interaction: discord.Interaction):
+        self.stop()
+        await interaction.response.edit_message(embed=discord.Embed(title="Import cancelled"), view=None)
+
+
+@holiday_seconds.time()
+async def holiday_banners():
     today = date.today()
-    req = requests.get(hebcal_api + f"&start={today}&end={today + timedelta(days=3)}")
-    res = req.json()
-
-    if len(res["items"]) >= 1:
-        item = res["items"][0]
-        title = item["title"].lower()
-
-        holiday_name = ""
-
-        holiday = None
-        for key in holidays.keys():
-            if key in title:
-                holiday = holidays[key]
-                holiday_name = key
-
-        if holiday is not None:
-            header = decode_escapes(holiday["header"])
-            content = decode_escapes(holiday["content"])
-            underscore_title = holiday_name.replace(" ", "_")
-            id = f"{underscore_title}_{today.year}"
-
-            json_text = {
-                "id": id,
-                "type": "holiday",
-                "persistent": True,
-                "header": header,
-                "content": content
-            }
-
-            banners = get_banners("V2")[1]
-            if id not in [banner["id"] for banner in banners]:
+    items = await holiday_calendar.items_between(today, today + timedelta(days=holiday_matcher.lead_days))
+    if items is None:
+        # No calendar at all, don't treat that as "no holidays" and clear every banner
+        return
+
+    active = holiday_matcher.active(items, today)
+    with banner_stores["V2"].transaction():
+        for id, holiday in active.items():
+            if banner_stores["V2"].get(id) is None:
+                json_text = {
+                    "id": id,
+                    "type": "holiday",
+                    "persistent": True,
+                    "header": holiday["header"],
+                    "content": holiday["content"]
+                }
+
                 add_edit_banner_json(json_text, "V2")
 
-    banners = get_banners("V2")[1]
-    for banner in banners:
-        ids = []
-        for x in res["items"]:
-            holiday_name = ""
-            for key in holidays.keys():
-                if key in x['title'].lower():
-                    holiday_name = key
+        for banner in banner_stores["V2"].all():
+            if holiday_matcher.is_holiday_id(banner["id"]) and banner["id"] not in active:
+                delete_banner("V2", banner)
 
-            ids.append(f"{holiday_name.replace(' ', '_')}_{today.year}")
 
-        if banner["id"] not in ids:
-            delete_banner("V2", banner)
+def filtered_banners(version, type=None, enabled=None):
+    store = banner_stores[version]
+    store.refresh()
 
+    key = (version, type, enabled)
+    cached = banner_pages.get(key)
+    if cached is None or cached[0] != store.revision:
+        banners = store.all()
+        if type is not None:
+            if version == "V2":
+                banners = [banner for banner in banners if banner["type"] == type]
+            else:
+                banners = [banner for banner in banners if banner["style"]["color"] == type_color(type)]
+        if enabled is not None:
+            banners = [banner for banner in banners if banner.get("enabled", True) == enabled]
 
-def view_banners_embed(version):
-    banners = get_banners(version)[1]
-    if len(banners) >= 1:
-        view = discord.ui.View(timeout=None)
+        cached = banner_pages[key] = (store.revision, banners)
+    return cached[1]
 
-        banner_ids = []
-        for index, banner in enumerate(banners):
-            banner_ids.append("[%s] %s" % (index, banner["id"]))
-            view.add_item(BannerButton(banner, index, version))
 
+def view_banners_embed(version, page=0, type=None, enabled=None, revision=None):
+    banners = filtered_banners(version, type, enabled)
+    if len(banners) >= 1:
+        pages = -(-len(banners) // BannerPages.page_size)
+        page = min(max(page, 0), pages - 1)
+        start = page * BannerPages.page_size
+        banners = banners[start:start + BannerPages.page_size]
+
+        state = {
+            "version": version,
+            "page": page,
+            "revision": banner_stores[version].revision,
+            "type": type,
+            "enabled": enabled
+        }
+        view = rendered(BannerPages(state, banners, pages))
+
+        banner_ids = ["[%s] %s" % (start + index, banner["id"]) for index, banner in enumerate(banners)]
         banner_message = "```\n%s```" % '\n'.join(banner_ids)
         return banner_message, view
     else:
@@ -472,45 +981,20 @@ def view_banners_embed(version):
         return banner_message, view
 
 
-def get_banners(version):
-    if version == "V2":
-        file_name = os.getenv("V2_FILE")
-    else:
-        file_name = os.getenv("V1_FILE")
-
-    if os.path.isfile(file_name):
-        with open(file_name, "r", encoding="utf-8") as fp:
-            data = json.load(fp)
-    else:
-        data = {
-            "banners": []
-        }
-
-    return data, data["banners"]
-
-
 def delete_banner(version, banner):
-    banners = get_banners(version)
-    banners[1].remove(banner)
+    banner_stores[version].delete(banner["id"])
 
-    if version == "V2":
-        file_name = os.getenv("V2_FILE")
-    else:
-        file_name = os.getenv("V1_FILE")
 
-    with open(file_name, "w+", encoding="utf-8") as fp:
-        json.dump(banners[0], fp, indent=4)
+def schedule_banner(json_text, starts_at, ends_at):
+    for field, value in (("starts_at", starts_at), ("ends_at", ends_at)):
+        if value is not None:
+            json_text[field] = None if value.lower() == "none" else format_time(parse_time(value))
 
 
 def add_edit_banner_json(json_text, version, old_id=None):
-    banners = get_banners(version)
+    store = banner_stores[version]
     if old_id is not None:
-        banner_old = None
-        banner_index = -1
-        for index, banner in enumerate(banners[1]):
-            if banner["id"] == old_id:
-                banner_index = index
-                banner_old = banner
+        banner_old = store.get(old_id)
 
         if json_text["id"] is None:
             json_text["id"] = banner_old["id"]
@@ -534,58 +1018,268 @@ def add_edit_banner_json(json_text, version, old_id=None):
             if json_text["style"]["color"] is None:
                 json_text["style"]["color"] = banner_old["style"]["color"]
 
-        banners[1][banner_index] = json_text
-    else:
-        banners[1].append(json_text)
+        for field in ("starts_at", "ends_at"):
+            if field not in json_text and field in banner_old:
+                json_text[field] = banner_old[field]
 
-    if version == "V2":
-        file_name = os.getenv("V2_FILE")
-    else:
-        file_name = os.getenv("V1_FILE")
+    for field in ("starts_at", "ends_at"):
+        if field in json_text and json_text[field] is None:
+            del json_text[field]
+    if json_text.get("enabled", True) is False:
+        # Switched off by hand, the schedule mustn't turn it back on
+        json_text["paused"] = True
+    apply_schedule(json_text)
 
-    with open(file_name, "w+", encoding="utf-8") as fp:
-        json.dump(banners[0], fp, indent=4)
+    store.put(json_text, old_id)
 
     return json_text
 
 
 def discord_color(type, version) -> discord.Color:
-    color = discord.Color.default()
+    if type in red_types + green_types + blue_types:
+        type = type_color(type)
+
+    if type in (red, green, blue):
+        return discord.Color(int(type[1:], 16))
+    return discord.Color.default()
+
+
+def shul_embed(shul):
+    return shul_discord_embed(shul.name, shul.nusach, shul.affiliation, shul.address, shul.city, shul.state,
+                              shul.zipcode, shul.latitude, shul.longitude, shul.rabbi, shul.email, shul.phone,
+                              shul.website)
+
+
+def flag_duplicates(embed, shul, key):
+    duplicates = shul_index.duplicates(shul, key)
+    shul_index.add(shul, "pending", key)
 
-    if type in red_types or type == red:
-        color = discord.Color.from_rgb(229, 62, 62)
-    elif type in green_types or type == green:
-        color = discord.Color.from_rgb(72, 187, 120)
-    elif type in blue_types or type == blue:
-        color = discord.Color.from_rgb(83, 132, 214)
+    if duplicates:
+        embed.add_field(name="Possible duplicate",
+                        value="\n".join("%s (%s, %d m)" % (entry["name"], entry["status"], meters)
+                                        for entry, meters in duplicates[:5]),
+                        inline=False)
+    return embed
+
+
+async def send_shul(row):
+    shul = Shul.from_json(row["shul"])
+    embed = flag_duplicates(shul_embed(shul), shul, row["id"])
+    async with discord_send_seconds.time(kind="single"):
+        message = await bot.get_channel(int(channel_id)).send(embed=embed, view=rendered(ShulView()))
+    await pending_shuls.sent([row["id"]], message.id)
+
+
+async def send_shul_batch(rows):
+    shuls = [Shul.from_json(row["shul"]) for row in rows]
+    embeds = [flag_duplicates(shul_embed(shul), shul, row["id"]) for shul, row in zip(shuls, rows)]
+
+    start = 0
+    while start < len(rows):
+        # Discord caps a message at 10 embeds and 6000 characters across all of them
+        end = start + 1
+        size = len(embeds[start])
+        while end < len(rows) and end - start < 10 and size + len(embeds[end]) <= 6000:
+            size += len(embeds[end])
+            end += 1
+
+        for index in range(start, end):
+            embeds[index].title = "%s. %s" % (index - start + 1, shuls[index].name)
+        async with discord_send_seconds.time(kind="batch"):
+            message = await bot.get_channel(int(channel_id)).send(embeds=embeds[start:end],
+                                                                   view=rendered(ShulBatchView(rows[start:end])))
+        await pending_shuls.sent([row["id"] for row in rows[start:end]], message.id)
+        start = end
+
+
+async def send_submission(batch_id):
+    await bot.wait_until_ready()
+
+    rows = await pending_shuls.batch(batch_id)
+    if len(rows) == 1:
+        await send_shul(rows[0])
+    elif rows:
+        await send_shul_batch(rows)
 
-    return color
+
+async def restore_pending():
+    for row in pending_shuls.pending():
+        shul_index.add(Shul.from_json(row["shul"]), "pending", row["id"])
+
+    # Accepted but never sent before the last shutdown. In MODE=bot the watcher's first look finds these
+    if mode == "single":
+        for batch_id in pending_shuls.queued_batches():
+            await shul_intake.put(batch_id)
+
+
+shul_intake = SubmissionQueue(send_submission)
+pending_watcher = PendingWatcher(pending_shuls, shul_intake)
+recent_shuls = RecentSubmissions(int(os.getenv("DUPLICATE_WINDOW", "600")))
+bulk_batch_size = 10
+bulk_max_content_length = int(os.getenv("BULK_MAX_BYTES", 256 * 1024 * 1024))
+
+
+async def intake_full():
+    if mode == "web":
+        # The queue itself lives in the bot process, what's still waiting in the pending store is as close as we get
+        return await pending_shuls.queued_count() >= shul_intake.queue.maxsize
+    return shul_intake.full()
+
+
+def hand_off(batch_id):
+    # Raises asyncio.QueueFull. A web worker has nothing to do, the bot picks the stored rows up on its own
+    if mode != "web":
+        shul_intake.submit(batch_id)
 
 
 @app.route("/shuls", methods=["POST"])
+@http_seconds.time(route="/shuls")
 async def add_shul_handle():
-    data = await request.get_json()
-    name = data.get('name')
-    rabbi = data.get('rabbi')
-    nusach = data.get('nusach')
-    affiliation = data.get('affiliation')
-    email = data.get('email')
-    phone = data.get('phone')
-    website = data.get('website')
-    address = data.get('address')
-    city = data.get('city')
-    state = data.get('state')
-    zipcode = data.get('zipcode')
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
-
-    view = ShulView(
-        Shul(name, rabbi, nusach, affiliation, email, phone, website, address, city, state, zipcode, latitude,
-             longitude))
-    embed = shul_discord_embed(name, nusach, affiliation, address, city, state, zipcode, latitude, longitude, rabbi,
-                               email, phone, website)
-    await bot.get_channel(int(channel_id)).send(embed=embed, view=view)
-    return "Embed Sent Successfully"
+    shul, error = parse_shul(await request.get_json(silent=True))
+    if error is not None:
+        shuls_received.inc(outcome="invalid")
+        return {"error": error}, 400
+
+    key = shul.content_hash()
+    submission_id = recent_shuls.get(key)
+    if submission_id is not None:
+        shuls_received.inc(outcome="duplicate")
+        return {"id": submission_id}, 202
+
+    submission_id = uuid.uuid4().hex
+    # Claimed before the first await, so an identical request arriving meanwhile gets this id too
+    recent_shuls.add(key, submission_id)
+    try:
+        full = await intake_full()
+    except Exception:
+        recent_shuls.discard(key)
+        raise
+    if full:
+        recent_shuls.discard(key)
+        shuls_received.inc(outcome="busy")
+        return {"error": "Too many pending submissions, try again later"}, 503, {"Retry-After": "30"}
+
+    try:
+        await pending_shuls.add(submission_id, [submission_id], [shul.to_json()])
+    except Exception:
+        recent_shuls.discard(key)
+        raise
+    try:
+        hand_off(submission_id)
+    except asyncio.QueueFull:
+        await pending_shuls.remove([submission_id])
+        recent_shuls.discard(key)
+        shuls_received.inc(outcome="busy")
+        return {"error": "Too many pending submissions, try again later"}, 503, {"Retry-After": "30"}
+
+    shuls_received.inc(outcome="accepted")
+    return {"id": submission_id}, 202
+
+
+async def queue_shul_batch(shuls):
+    batch_id = uuid.uuid4().hex
+    await pending_shuls.add(batch_id, [uuid.uuid4().hex for _ in shuls], shuls)
+    if mode != "web":
+        # Waits for room in the queue, which holds the upload back instead of buffering it
+        await shul_intake.put(batch_id)
+    return batch_id
+
+
+@app.route("/shuls/bulk", methods=["POST"])
+@http_seconds.time(route="/shuls/bulk")
+async def add_shuls_bulk_handle():
+    # The body is streamed record by record, so memory doesn't grow with BULK_MAX_BYTES
+    accepted = 0
+    rejected = 0
+    errors = []
+    ids = []
+    batch = []
+    async for index, data, error in iter_records(request.body):
+        if error is None:
+            shul, error = parse_shul(data)
+        if error is not None:
+            rejected += 1
+            if len(errors) < 100:
+                errors.append({"index": index, "error": error})
+            continue
+
+        batch.append(shul.to_json())
+        accepted += 1
+        if len(batch) == bulk_batch_size:
+            ids.append(await queue_shul_batch(batch))
+            batch = []
+
+    if batch:
+        ids.append(await queue_shul_batch(batch))
+
+    shuls_received.inc(accepted, outcome="accepted")
+    shuls_received.inc(rejected, outcome="invalid")
+    return {"accepted": accepted, "rejected": rejected, "errors": errors, "ids": ids}, 202
+
+
+@app.route("/banners/<version>", methods=["GET"])
+@http_seconds.time(route="/banners/<version>")
+async def banners_handle(version):
+    feed = banner_feeds.get(version.upper())
+    if feed is None:
+        return "Unknown banner version", 404
+
+    feed = feed.get()
+    if feed.brotli_body is not None and request.accept_encodings.quality("br") > 0:
+        etag = feed.etag + "-br"
+        body = feed.brotli_body
+    elif request.accept_encodings.quality("gzip") > 0:
+        etag = feed.etag + "-gzip"
+        body = feed.gzip_body
+    else:
+        etag = feed.etag
+        body = feed.body
+
+    headers = {
+        "ETag": '"%s"' % etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "no-cache"
+    }
+
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    if body is feed.brotli_body:
+        headers["Content-Encoding"] = "br"
+    elif body is feed.gzip_body:
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(body, content_type="application/json", headers=headers)
+
+
+@app.route("/banners/<version>/changes", methods=["GET"])
+@http_seconds.time(route="/banners/<version>/changes")
+async def banner_changes_handle(version):
+    store = banner_stores.get(version.upper())
+    if store is None:
+        return "Unknown banner version", 404
+
+    since = request.args.get("since", type=int)
+    if mode == "web":
+        store.refresh()
+        revision = store.revision
+        changes = await banner_log.changes_since(version.upper(), since, revision)
+    else:
+        revision = store.revision
+        changes = store.changes_since(since)
+    if changes is None:
+        feed = banner_feeds[version.upper()].get()
+        body = b'{"revision":%d,"snapshot":%s}' % (feed.revision, feed.body)
+    else:
+        body = json.dumps({"revision": revision, "changes": changes}, separators=(",", ":"),
+                          ensure_ascii=False).encode("utf-8")
+
+    return Response(body, content_type="application/json", headers={"Cache-Control": "no-cache"})
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_handle():
+    return Response(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 def shul_discord_embed(name, nusach, affiliation, address, city, state, zipcode, latitude, longitude, rabbi, email,
@@ -601,22 +1295,41 @@ def shul_discord_embed(name, nusach, affiliation, address, city, state, zipcode,
     return embed
 
 
-def discord_embed(id, color, content, enabled, header="", persistent=True, version="V2"):
+def discord_embed(id, color, content, enabled, header="", persistent=True, version="V2", starts_at=None,
+                  ends_at=None):
     color = discord_color(color, version)
+    footer = "Persistent: %s, Enabled: %s" % (persistent, enabled)
+    if starts_at is not None:
+        footer += ", Starts: %s" % starts_at
+    if ends_at is not None:
+        footer += ", Ends: %s" % ends_at
     embed = discord.Embed(title=header, description=content, color=color) \
-        .set_author(name=id).set_footer(text="Persistent: %s, Enabled: %s" % (persistent, enabled))
+        .set_author(name=id).set_footer(text=footer)
     return embed
 
 
 if __name__ == "__main__":
+    if mode == "web":
+        config = Config()
+        # hypercorn resolves the module against the working directory, so name this file outright
+        config.application_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py") + ":app"
+        config.bind = ["127.0.0.1:%s" % os.getenv("PORT")]
+        config.workers = int(os.getenv("WEB_WORKERS", os.cpu_count()))
+        sys.exit(run_hypercorn(config))
+
     scheduler = AsyncIOScheduler()
     scheduler.configure(timezone=utc)
     scheduler.add_job(holiday_banners, 'cron', hour=0)
     scheduler.start()
 
     try:
-        bot.loop.create_task(app.run_task(port=int(os.getenv("PORT"))))
+        if mode == "single":
+            bot.loop.create_task(app.run_task(port=int(os.getenv("PORT"))))
+        elif os.getenv("METRICS_PORT"):
+            # Only for scraping /metrics, submissions go to the web workers
+            bot.loop.create_task(app.run_task(port=int(os.getenv("METRICS_PORT"))))
         bot.run(os.getenv("TOKEN"))
         asyncio.get_event_loop().run_forever()
     except (KeyboardInterrupt, SystemExit):
+        # bot.run already went through ShulertBot.close, which flushed and published the banners
         pass
@@ -0,0 +1,143 @@
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+
+# Prometheus text format without the client library. Recording is a dict update, the text is only
+# built when /metrics is scraped
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in zip(names, values))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, self.labels, key, value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, help, function=None, labels=()):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            # Read at scrape time, nothing to keep up to date in between
+            yield self.name, (), (), self.function()
+        else:
+            yield from super().samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        names = self.labels + ("le",)
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield self.name + "_bucket", names, key + (bound,), cumulative
+            yield self.name + "_sum", self.labels, key, total
+            yield self.name + "_count", self.labels, key, cumulative
+
+
+class Timer:
+    # `with histogram.time(...)`, `async with histogram.time(...)` or `@histogram.time(...)`
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+    def __call__(self, function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.histogram.observe(time.perf_counter() - start, **self.labels)
+        else:
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.histogram.observe(time.perf_counter() - start, **self.labels)
+        return timed
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append("# HELP %s %s" % (metric.name, metric.help))
+        lines.append("# TYPE %s %s" % (metric.name, metric.type))
+        for name, labels, values, value in metric.samples():
+            lines.append("%s%s %s" % (name, _format_labels(labels, values), value))
+    return "\n".join(lines) + "\n"
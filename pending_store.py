@@ -0,0 +1,124 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+
+class PendingStore:
+    def __init__(self, file_name):
+        self.db = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS submissions (
+                    id TEXT PRIMARY KEY,
+                    batch_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    message_id INTEGER,
+                    created_at REAL NOT NULL
+                )""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS submissions_batch ON submissions (batch_id, position)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS submissions_message ON submissions (message_id, position)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS submissions_status ON submissions (status)")
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, self._locked, function, args)
+
+    def _locked(self, function, args):
+        with self.lock:
+            return function(*args)
+
+    @staticmethod
+    def _row(row):
+        id, position, payload, status = row
+        return {"id": id, "position": position, "shul": json.loads(payload), "status": status}
+
+    def _add(self, batch_id, ids, shuls):
+        now = time.time()
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT INTO submissions (id, batch_id, position, payload, created_at) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                [(id, batch_id, position, json.dumps(shul), now)
+                                 for position, (id, shul) in enumerate(zip(ids, shuls))])
+
+    async def add(self, batch_id, ids, shuls):
+        await self._run(self._add, batch_id, ids, shuls)
+
+    def _batch(self, batch_id):
+        return [self._row(row) for row in self.db.execute(
+            "SELECT id, position, payload, status FROM submissions WHERE batch_id = ? AND status = 'queued' "
+            "ORDER BY position", (batch_id,))]
+
+    async def batch(self, batch_id):
+        return await self._run(self._batch, batch_id)
+
+    def _sent(self, ids, message_id):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE submissions SET status = 'pending', message_id = ?, position = ? "
+                                "WHERE id = ?", [(message_id, position, id) for position, id in enumerate(ids)])
+
+    async def sent(self, ids, message_id):
+        await self._run(self._sent, ids, message_id)
+
+    def _message(self, message_id):
+        return [self._row(row) for row in self.db.execute(
+            "SELECT id, position, payload, status FROM submissions WHERE message_id = ? ORDER BY position",
+            (message_id,))]
+
+    async def message(self, message_id):
+        return await self._run(self._message, message_id)
+
+    def _resolve(self, id, status):
+        self.db.execute("UPDATE submissions SET status = ? WHERE id = ?", (status, id))
+
+    async def resolve(self, id, status):
+        await self._run(self._resolve, id, status)
+
+    def _remove(self, ids):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM submissions WHERE id = ?", [(id,) for id in ids])
+
+    async def remove(self, ids):
+        await self._run(self._remove, ids)
+
+    def _queued_batches(self):
+        return [row[0] for row in self.db.execute(
+            "SELECT batch_id FROM submissions WHERE status = 'queued' GROUP BY batch_id ORDER BY MIN(created_at)")]
+
+    def queued_batches(self):
+        with self.lock:
+            return self._queued_batches()
+
+    def _queued_since(self, version):
+        # data_version only moves when another connection commits, so our own updates don't count as news
+        current = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if current == version:
+            return current, None
+        return current, self._queued_batches()
+
+    async def queued_since(self, version):
+        return await self._run(self._queued_since, version)
+
+    def _queued_count(self):
+        return self.db.execute("SELECT COUNT(DISTINCT batch_id) FROM submissions WHERE status = 'queued'").fetchone()[0]
+
+    async def queued_count(self):
+        return await self._run(self._queued_count)
+
+    def pending(self):
+        with self.lock:
+            return [self._row(row) for row in self.db.execute(
+                "SELECT id, position, payload, status FROM submissions WHERE status = 'pending'")]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
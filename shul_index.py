@@ -0,0 +1,136 @@
+import asyncio
+import json
+import math
+import os
+import re
+from difflib import SequenceMatcher
+
+EARTH_RADIUS = 6371000
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+NAME_WORDS_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = {"congregation", "cong", "synagogue", "shul", "temple", "the", "of", "and", "inc"}
+SPELLINGS = {
+    "beth": "beis",
+    "bais": "beis",
+    "beit": "beis",
+    "bet": "beis",
+    "kehillas": "kehilas",
+    "kehillat": "kehilas",
+    "kehilat": "kehilas",
+    "yisrael": "yisroel",
+    "israel": "yisroel",
+    "lubavitch": "chabad"
+}
+
+
+def normalize_name(name):
+    words = NAME_WORDS_RE.findall((name or "").lower())
+    return " ".join(SPELLINGS.get(word, word) for word in words if word not in STOP_WORDS)
+
+
+def distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def coordinates(shul):
+    try:
+        return float(shul.latitude), float(shul.longitude)
+    except (TypeError, ValueError):
+        return None
+
+
+class ShulIndex:
+    def __init__(self, snapshot_file=None, cell_size=0.01, radius=250, threshold=0.8):
+        self.snapshot_file = snapshot_file
+        self.cell_size = cell_size
+        self.radius = radius
+        self.threshold = threshold
+        self.cells = {}
+        self.keys = {}
+
+        if snapshot_file is not None and os.path.isfile(snapshot_file):
+            with open(snapshot_file, "r", encoding="utf-8") as fp:
+                for line in fp:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._insert(entry["name"], entry["latitude"], entry["longitude"], "approved",
+                                     entry.get("key"))
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def _insert(self, name, latitude, longitude, status, key=None):
+        if key is not None:
+            self.remove(key)
+
+        cell = self._cell(latitude, longitude)
+        entry = {
+            "name": name,
+            "normalized": normalize_name(name),
+            "latitude": latitude,
+            "longitude": longitude,
+            "status": status,
+            "key": key
+        }
+        self.cells.setdefault(cell, []).append(entry)
+        if key is not None:
+            self.keys[key] = cell
+        return entry
+
+    def add(self, shul, status, key=None):
+        location = coordinates(shul)
+        if location is None:
+            return None
+        return self._insert(shul.name, location[0], location[1], status, key)
+
+    def remove(self, key):
+        cell = self.keys.pop(key, None)
+        if cell is None:
+            return
+
+        entries = [entry for entry in self.cells[cell] if entry["key"] != key]
+        if entries:
+            self.cells[cell] = entries
+        else:
+            del self.cells[cell]
+
+    def nearby(self, latitude, longitude):
+        # Only the cells the search radius can reach, longitude cells shrink toward the poles
+        row, column = self._cell(latitude, longitude)
+        rows = math.ceil(self.radius / (self.cell_size * METERS_PER_DEGREE))
+        columns = math.ceil(self.radius / (self.cell_size * METERS_PER_DEGREE *
+                                           max(math.cos(math.radians(latitude)), 0.01)))
+
+        for cell_row in range(row - rows, row + rows + 1):
+            for cell_column in range(column - columns, column + columns + 1):
+                for entry in self.cells.get((cell_row, cell_column), ()):
+                    meters = distance(latitude, longitude, entry["latitude"], entry["longitude"])
+                    if meters <= self.radius:
+                        yield entry, meters
+
+    def duplicates(self, shul, key=None):
+        location = coordinates(shul)
+        if location is None:
+            return []
+
+        normalized = normalize_name(shul.name)
+        duplicates = []
+        for entry, meters in self.nearby(*location):
+            if entry["key"] is not None and entry["key"] == key:
+                continue
+            if SequenceMatcher(None, normalized, entry["normalized"]).ratio() >= self.threshold:
+                duplicates.append((entry, meters))
+        return sorted(duplicates, key=lambda duplicate: duplicate[1])
+
+    def _append(self, entry):
+        with open(self.snapshot_file, "a", encoding="utf-8") as fp:
+            fp.write(json.dumps({"name": entry["name"], "latitude": entry["latitude"],
+                                 "longitude": entry["longitude"], "key": entry["key"]}) + "\n")
+
+    async def approve(self, shul, key=None):
+        entry = self.add(shul, "approved", key)
+        if entry is not None and self.snapshot_file is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._append, entry)
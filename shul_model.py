@@ -0,0 +1,154 @@
+import hashlib
+import json
+import math
+import re
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+MAX_LENGTH = 200
+
+WHITESPACE_RE = re.compile(r"\s+")
+NON_DIGITS_RE = re.compile(r"\D+")
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+# US ZIP, ZIP+4 or a Canadian postal code
+ZIPCODE_RE = re.compile(r"(\d{5})(?:-?(\d{4}))?|([A-Z]\d[A-Z]) ?(\d[A-Z]\d)")
+
+FIELDS = ("name", "rabbi", "nusach", "affiliation", "email", "phone", "website", "address", "city", "state",
+          "zipcode", "latitude", "longitude")
+
+
+@dataclass(frozen=True)
+class Shul:
+    # Spelled out rather than dataclass(slots=True), which needs Python 3.10. Every field is passed, in FIELDS
+    # order, since defaults can't sit beside __slots__
+    __slots__ = FIELDS
+
+    name: str
+    rabbi: str
+    nusach: str
+    affiliation: str
+    email: str
+    phone: str
+    website: str
+    address: str
+    city: str
+    state: str
+    zipcode: str
+    latitude: float
+    longitude: float
+
+    @classmethod
+    def from_json(cls, data):
+        # For rows that were validated on the way in, see parse_shul for anything from outside
+        return cls(*(data.get(name) for name in FIELDS))
+
+    def to_json(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def content_hash(self):
+        return hashlib.sha256(json.dumps(self.to_json(), sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    value = WHITESPACE_RE.sub(" ", value).strip()
+    if len(value) > MAX_LENGTH:
+        raise ValueError("is longer than %d characters" % MAX_LENGTH)
+    return value or None
+
+
+def _coordinate(limit):
+    def normalize(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError("must be a number")
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError("must be a number") from None
+        if math.isnan(number) or not -limit <= number <= limit:
+            raise ValueError("must be between -%d and %d" % (limit, limit))
+        return round(number, 6)
+
+    return normalize
+
+
+def _email(value):
+    value = _text(value)
+    if value is not None and not EMAIL_RE.fullmatch(value):
+        raise ValueError("is not an email address")
+    return value
+
+
+def _phone(value):
+    value = _text(value)
+    if value is None:
+        return None
+
+    digits = NON_DIGITS_RE.sub("", value)
+    if len(digits) == 11 and digits[0] == "1":
+        digits = digits[1:]
+    if len(digits) == 10:
+        return "%s-%s-%s" % (digits[:3], digits[3:6], digits[6:])
+    if value.startswith("+") and 8 <= len(digits) <= 15:
+        return "+" + digits
+    raise ValueError("is not a phone number")
+
+
+def _website(value):
+    value = _text(value)
+    if value is None:
+        return None
+
+    if "://" not in value:
+        value = "https://" + value
+    try:
+        parts = urlsplit(value)
+        valid = parts.scheme.lower() in ("http", "https") and "." in (parts.hostname or "")
+    except ValueError:
+        valid = False
+    if not valid or " " in value:
+        raise ValueError("is not a website address")
+    return value
+
+
+def _zipcode(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        # A leading zero gets lost when a form sends the zip as a number
+        value = "%05d" % value
+    value = _text(value)
+    if value is None:
+        return None
+
+    match = ZIPCODE_RE.fullmatch(value.upper())
+    if match is None:
+        raise ValueError("is not a ZIP or postal code")
+    if match.group(1):
+        return match.group(1) + ("-" + match.group(2) if match.group(2) else "")
+    return match.group(3) + " " + match.group(4)
+
+
+# (name, normalizer, required) in field order, built once so a payload is checked in a single pass
+NORMALIZERS = {"email": _email, "phone": _phone, "website": _website, "zipcode": _zipcode,
+               "latitude": _coordinate(90), "longitude": _coordinate(180)}
+VALIDATORS = tuple((name, NORMALIZERS.get(name, _text), name in ("name", "latitude", "longitude"))
+                   for name in FIELDS)
+
+
+def parse_shul(data):
+    # Returns (shul, None) or (None, error) for a submitted JSON object
+    if not isinstance(data, dict):
+        return None, "Expected a JSON object"
+
+    values = []
+    for name, normalize, required in VALIDATORS:
+        value = data.get(name)
+        if value is not None:
+            try:
+                value = normalize(value)
+            except ValueError as e:
+                return None, "%s %s" % (name.capitalize(), e)
+        if value is None and required:
+            return None, "Missing %s" % name
+        values.append(value)
+    return Shul(*values), None
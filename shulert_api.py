@@ -0,0 +1,58 @@
+import asyncio
+import json
+import random
+import uuid
+
+import aiohttp
+
+from metrics import Counter, Histogram
+
+api_seconds = Histogram("shulert_api_seconds", "Shulert API call latency, per attempt")
+api_requests = Counter("shulert_api_requests_total", "Shulert API call attempts by response status", ("status",))
+
+
+class ShulertClient:
+    def __init__(self, auth, timeout=10, retries=3, backoff=0.5, limit=20, keepalive=60):
+        self.auth = auth
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.limit = limit
+        self.keepalive = keepalive
+        self.session = None
+
+    def start(self):
+        # on_ready fires again on every reconnect, keep the pool we already have
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=self.keepalive)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                 headers={"Authorization": self.auth})
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def post(self, url, json_body, idempotency_key=None):
+        if idempotency_key is None:
+            idempotency_key = str(uuid.uuid4())
+
+        self.start()
+        for attempt in range(self.retries + 1):
+            try:
+                async with api_seconds.time(), self.session.post(url, json=json_body,
+                                                                 headers={"Idempotency-Key": idempotency_key}) as resp:
+                    text = await resp.text()
+                    api_requests.inc(status=resp.status)
+                    if resp.status < 500 or attempt == self.retries:
+                        try:
+                            return resp.status, json.loads(text)
+                        except ValueError:
+                            return resp.status, {"error": text}
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                api_requests.inc(status="error")
+                if attempt == self.retries:
+                    raise
+
+            # Exponential backoff with jitter, the idempotency key makes the retry safe
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1))